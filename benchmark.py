@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# cgxEasyAPI benchmarks against a local mock controller
+import sys
+import json
+import time
+import logging
+import argparse
+import fnmatch
+import re
+from concurrent.futures import ThreadPoolExecutor
+import db
+import metrics
+import cgxEasyAPI
+import mock_controller
+
+def bench_prefetch(cgxapi, elements):
+    return cgxapi.prefetch_interfaces([element['name'] for element in elements])
+
+def bench_tag(cgxapi, element):
+    return cgxapi.interface_tag_add(element['name'], "1", "benchmark")
+
+def bench_zone(cgxapi, element):
+    return cgxapi.set_interface_zone(element['name'], "2", "GUEST")
+
+def bench_dhcprelay(cgxapi, element):
+    return cgxapi.interface_dhcprelay_add(element['name'], "3", "10.255.0.1")
+
+def bench_changes(cgxapi, element):
+    return cgxapi.interface_changes(element['name'], "5").add_tag("benchmark").add_dhcp_relay("10.255.0.1").set_description("benchmark").commit()
+
+def bench_subinterface(cgxapi, element):
+    return cgxapi.interface_add_subinterface(element['name'], "4", 100, "172.16.0.1/24", "local")
+
+def bench_snmpv3(cgxapi, element):
+    return cgxapi.set_snmpv3_agent(element['name'], "benchmark", "auth", "0123456789ab", "benchmark", "sha", None, "none")
+
+def bench_dhcp_pool_option(cgxapi, site):
+    return cgxapi.dhcp_pool_add_option(site['name'], site['subnet'], "", "option bench code 224 = text", 'option bench "x"')
+
+def bench_local_prefix(cgxapi, site):
+    return cgxapi.sec_policy_add_local_prefix("benchmark", site['name'], ["10.0.0.0/8"])
+
+def bench_global_prefix(cgxapi, sites):
+    return cgxapi.net_policy_add_global_prefix("benchmark", [f"10.{n // 256 % 256}.{n % 256}.0/24" for n in range(len(sites))])
+
+def bench_fabric(cgxapi, sites):
+    hubs = [site['name'] for site in sites if site['element_cluster_role'] == "HUB"]
+    return cgxapi.secure_fabric_build([site['name'] for site in sites], hub_names=hubs)
+
+# name, function, "element", "site" (called for each) or "elements", "sites" (called once with all)
+BENCHMARKS = [
+    ("prefetch_interfaces", bench_prefetch, "elements"),
+    ("interface_tag_add", bench_tag, "element"),
+    ("set_interface_zone", bench_zone, "element"),
+    ("interface_dhcprelay_add", bench_dhcprelay, "element"),
+    ("interface_changes", bench_changes, "element"),
+    ("interface_add_subinterface", bench_subinterface, "element"),
+    ("set_snmpv3_agent", bench_snmpv3, "element"),
+    ("dhcp_pool_add_option", bench_dhcp_pool_option, "site"),
+    ("sec_policy_add_local_prefix", bench_local_prefix, "site"),
+    ("net_policy_add_global_prefix", bench_global_prefix, "sites"),
+    ("secure_fabric_build", bench_fabric, "sites"),
+]
+
+def api_calls():
+    """ SDK calls so far, per endpoint
+    """
+    return {endpoint: entry["count"] for endpoint, entry in metrics.snapshot()["calls"].items()}
+
+def run_scale(elements, workers, latency, error_rate, only=None, rerun=False):
+    """ run the benchmarks against a fresh mock controller with elements elements
+    :return: list of result dictionaries
+    """
+    controller = mock_controller.MockController(latency=latency, error_rate=error_rate, seed=elements)
+    controller.populate(elements)
+    url = controller.start()
+    try:
+        # never touch the user's snapshot
+        db.CACHE_FILE = None
+        db.clear()
+        cgxapi = cgxEasyAPI.cgxEasyAPI(mock_controller.AUTH_TOKEN, controller=url, update_check=False, pool_size=workers)
+        logging.getLogger("cgxEasyAPI").setLevel(logging.CRITICAL)
+
+        results = []
+        metrics.reset()
+        start = time.perf_counter()
+        db.refresh()
+        results.append(result("db.refresh", elements, 1, time.perf_counter() - start, 0, api_calls(), 0))
+
+        sites = list(db.db['name2site'].values())
+        # DHCP server subnet of each site
+        subnets = {
+            server['site_id']: server['subnet']
+            for path, servers in controller.store.items() if path.endswith("/dhcpservers")
+            for server in servers.values()
+        }
+        sites = [dict(site, subnet=subnets.get(site['id'])) for site in sites]
+        objects = {"element": list(db.db['name2element'].values()), "site": sites}
+
+        for name, func, scope in BENCHMARKS * (2 if rerun else 1):
+            if only and name not in only:
+                continue
+            metrics.reset()
+            start = time.perf_counter()
+            if scope in objects:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    outcomes = list(executor.map(lambda obj: func(cgxapi, obj), objects[scope]))
+            else:
+                outcomes = [func(cgxapi, objects[scope[:-1]])]
+            seconds = time.perf_counter() - start
+            failed = sum(1 for res, err in outcomes if not res)
+            unchanged = sum(1 for res, err in outcomes if res and err == cgxEasyAPI.UNCHANGED)
+            results.append(result(name, elements, len(outcomes), seconds, failed, api_calls(), unchanged))
+        return results
+    finally:
+        controller.stop()
+
+def result(name, elements, ops, seconds, failed, calls, unchanged):
+    return {
+        "benchmark": name,
+        "elements": elements,
+        "ops": ops,
+        "failed": failed,
+        "unchanged": unchanged,
+        "seconds": round(seconds, 4),
+        "ops_per_sec": round(ops / seconds, 1) if seconds else None,
+        "api_calls": sum(calls.values()),
+        "api_calls_per_op": round(sum(calls.values()) / ops, 2) if ops else None,
+        "calls": calls,
+    }
+
+def bench_db(elements, repeat=20):
+    """ micro-benchmark of the db lookups on elements tables, against a full scan of name2element
+    :param elements: number of elements
+    :type elements: int
+    :param repeat: calls per lookup
+    :type repeat: int
+    :return: list of (lookup, scan microseconds per call, db microseconds per call)
+    """
+    db.clear()
+    db._build_elements([
+        {"id": str(n), "name": f"branch-{n:05d}-ion", "site_id": str(n // 2), "serial_number": f"SN{n:08d}"}
+        for n in range(elements)
+    ])
+    db.db_time['elements'] = time.time()
+    table = db.db['name2element']
+    site_id = str(elements // 4)
+
+    lookups = [
+        ("get_re ^prefix", lambda: [v for k, v in table.items() if re.search("^branch-123", k)], lambda: db.get_re("name2element", "^branch-123")),
+        ("get_re unanchored", lambda: [v for k, v in table.items() if re.search("123.*ion", k)], lambda: db.get_re("name2element", "123.*ion")),
+        ("get_glob prefix*", lambda: [v for k, v in table.items() if fnmatch.fnmatchcase(k, "branch-123*")], lambda: db.get_glob("name2element", "branch-123*")),
+        ("element by id", lambda: [v for v in table.values() if v['id'] == site_id], lambda: db.fetch("id2element", site_id)),
+        ("elements of a site", lambda: [v for v in table.values() if v['site_id'] == site_id], lambda: db.fetch("site_id2elements", site_id)),
+    ]
+    results = []
+    for name, scan, indexed in lookups:
+        timings = []
+        for func in (scan, indexed):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            timings.append((time.perf_counter() - start) / repeat * 1e6)
+        results.append((name, *timings))
+    db.clear()
+    return results
+
+def check_status_retry(status=429, calls=50):
+    """ check that error statuses come back from the SDK as responses retried by the transport,
+    instead of exceptions raised by urllib3
+    :param status: status code the mock controller fails calls with
+    :type status: int
+    :param calls: number of calls
+    :type calls: int
+    :return: Success, ErrMSG
+    """
+    controller = mock_controller.MockController(error_status=status, seed=1)
+    controller.populate(2)
+    url = controller.start()
+    try:
+        db.CACHE_FILE = None
+        db.clear()
+        cgxapi = cgxEasyAPI.cgxEasyAPI(mock_controller.AUTH_TOKEN, controller=url, update_check=False,
+                                       retry={"default": {"backoff": 0.001, "retries": 10}})
+        logging.getLogger("cgxEasyAPI").setLevel(logging.CRITICAL)
+        # the login is not retried, fail calls from here on
+        controller.error_rate = 0.3
+        failed = 0
+        for _ in range(calls):
+            try:
+                res = cgxapi.sdk.get.sites()
+            except Exception as e:
+                return False, f"{status} raised {type(e).__name__}: {e}"
+            if not res:
+                failed += 1
+        errors = sum(count for call, count in controller.calls.items() if call.startswith("GET sites")) - calls
+        if failed:
+            return False, f"{failed} of {calls} calls failed after retries"
+        if not errors:
+            return False, f"no {status} was injected"
+        return True, f"{calls} calls succeeded, {errors} {status} responses retried"
+    finally:
+        controller.stop()
+
+def print_results(results):
+    width = max(len(row["benchmark"]) for row in results)
+    print(f"{'Benchmark':<{width}}  {'Elements':>8}  {'Ops':>6}  {'Failed':>6}  {'Same':>6}  {'Seconds':>8}  {'Ops/s':>8}  {'API calls':>9}  {'Calls/op':>8}")
+    for row in results:
+        print(f"{row['benchmark']:<{width}}  {row['elements']:>8}  {row['ops']:>6}  {row['failed']:>6}  {row['unchanged']:>6}  {row['seconds']:>8.2f}  "
+              f"{row['ops_per_sec'] or 0:>8.1f}  {row['api_calls']:>9}  {row['api_calls_per_op'] or 0:>8.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="cgxEasyAPI benchmarks against a local mock controller")
+    parser.add_argument("--scales", default="10,100,1000,10000", help="comma separated element counts")
+    parser.add_argument("--workers", type=int, default=8, help="elements worked on in parallel")
+    parser.add_argument("--latency", type=float, default=0, help="mock controller latency per call in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of mock controller calls failing with 503")
+    parser.add_argument("--only", help="comma separated benchmark names")
+    parser.add_argument("--rerun", action="store_true", help="run every benchmark twice, the second run measures idempotent reruns")
+    parser.add_argument("--json", help="write the results to a JSON file")
+    parser.add_argument("--check", action="store_true", help="only check that 429 responses are retried, not raised")
+    parser.add_argument("--db", type=int, metavar="ELEMENTS", help="only run the db lookup micro-benchmark with ELEMENTS elements, e.g. 50000")
+    args = parser.parse_args()
+
+    if args.check:
+        logging.getLogger("cloudgenix.interactive").setLevel(logging.ERROR)
+        res, err = check_status_retry()
+        print(err)
+        sys.exit(0 if res else 1)
+
+    if args.db:
+        print(f"{'Lookup':<20}  {'Scan us':>10}  {'db us':>10}  {'Speedup':>8}")
+        for name, scan, indexed in bench_db(args.db):
+            print(f"{name:<20}  {scan:>10.1f}  {indexed:>10.1f}  {scan / indexed:>7.0f}x")
+        sys.exit()
+
+    # the mock token has no region
+    logging.getLogger("cloudgenix.interactive").setLevel(logging.ERROR)
+    only = args.only.split(",") if args.only else None
+    results = []
+    for scale in (int(scale) for scale in args.scales.split(",")):
+        print(f"--- {scale} elements", file=sys.stderr)
+        results.extend(run_scale(scale, args.workers, args.latency, args.error_rate, only, args.rerun))
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
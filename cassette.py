@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# record and replay of SDK calls for network free runs
+import os
+import sys
+import json
+import gzip
+import time
+import logging
+import threading
+from collections import Counter, defaultdict, deque
+import requests
+
+log = logging.getLogger("cgxEasyAPI.cassette")
+
+CASSETTE_VERSION = 1
+# request and response fields with these words in their name are replaced by SCRUBBED
+SECRET_KEYS = ["phrase", "password", "token", "secret", "community", "psk", "private_key"]
+SCRUBBED = "***"
+# status code of calls that are not in the cassette
+MISS_STATUS = 404
+
+def scrub(value):
+    """ copy of value with the secrets replaced
+    :param value: request arguments or response content
+    :return: scrubbed copy
+    """
+    if isinstance(value, dict):
+        return {
+            key: SCRUBBED if value[key] and isinstance(key, str) and any(secret in key.lower() for secret in SECRET_KEYS)
+            else scrub(value[key])
+            for key in value
+        }
+    if isinstance(value, (list, tuple)):
+        return [scrub(item) for item in value]
+    return value
+
+def request_keys(namespace, endpoint, args, kwargs):
+    """ keys a call is matched with on replay. The exact key includes the request body,
+    the loose key only the object ids, so replays still match when the body changed
+    :return: exact key, loose key
+    :rtype: tuple
+    """
+    args = scrub(list(args))
+    kwargs = scrub(kwargs)
+    exact = json.dumps([namespace, endpoint, args, kwargs], sort_keys=True, default=str)
+    loose = json.dumps([namespace, endpoint, [arg for arg in args if not isinstance(arg, (dict, list))]], default=str)
+    return exact, loose
+
+def make_response(status_code, content, headers=None):
+    """ SDK style response from recorded values
+    :rtype: requests.Response
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(content).encode()
+    response.headers.update(headers or {})
+    response.cgx_status = status_code < 400
+    response.cgx_content = content
+    response.cgx_errors = None
+    response.cgx_warnings = None
+    return response
+
+class Cassette:
+    """ records SDK calls and their responses to a gzip JSON lines file, or serves them back.
+    The first line has the tenant and controller, every other line is one call
+    """
+    def __init__(self, file_name, mode="replay", speed=0):
+        """
+        :param file_name: cassette file
+        :type file_name: str
+        :param mode: "record" or "replay"
+        :type mode: str
+        :param speed: replay timing. 1 for the recorded latency, 0 for as fast as possible
+        :type speed: float
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode}")
+        self.file_name = os.path.expanduser(file_name)
+        self.mode = mode
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.tenant_id = None
+        self.controller = None
+        self.file = None
+        self.start_time = time.monotonic()
+        # replay queues, key -> interactions in recorded order
+        self.exact = defaultdict(deque)
+        self.loose = defaultdict(deque)
+        self.misses = 0
+        if mode == "replay":
+            self.load()
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def start(self, sdk):
+        """ start recording calls made with an authenticated SDK object
+        :param sdk: cloudgenix API object
+        :type sdk: cloudgenix.API()
+        """
+        self.tenant_id = sdk.tenant_id
+        self.controller = sdk.controller
+        self.file = gzip.open(self.file_name, "wt")
+        self.file.write(json.dumps({"version": CASSETTE_VERSION, "tenant_id": self.tenant_id, "controller": self.controller}) + "\n")
+
+    def record(self, namespace, endpoint, args, kwargs, res, latency):
+        """ add a call to the cassette
+        :param res: SDK response
+        :type res: requests.Response
+        :param latency: call duration in seconds
+        :type latency: float
+        """
+        interaction = {
+            "time": round(time.monotonic() - self.start_time, 4),
+            "namespace": namespace,
+            "endpoint": endpoint,
+            "args": scrub(list(args)),
+            "kwargs": scrub(kwargs),
+            "status": res.status_code,
+            "latency": round(latency, 4),
+            "content": scrub(res.cgx_content),
+        }
+        if res.headers and res.headers.get("Retry-After"):
+            interaction["headers"] = {"Retry-After": res.headers["Retry-After"]}
+        line = json.dumps(interaction, separators=(",", ":"), default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def load(self):
+        """ read the cassette for replay
+        """
+        with gzip.open(self.file_name, "rt") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"{self.file_name} is not a version {CASSETTE_VERSION} cassette")
+            self.tenant_id = header["tenant_id"]
+            self.controller = header["controller"]
+            for line in f:
+                interaction = json.loads(line)
+                interaction["used"] = False
+                exact, loose = request_keys(interaction["namespace"], interaction["endpoint"], interaction["args"], interaction["kwargs"])
+                self.exact[exact].append(interaction)
+                self.loose[loose].append(interaction)
+
+    def _next(self, queue):
+        while queue and queue[0]["used"]:
+            queue.popleft()
+        if queue:
+            interaction = queue.popleft()
+            interaction["used"] = True
+            return interaction
+        return None
+
+    def replay(self, namespace, endpoint, args, kwargs):
+        """ the recorded response of a call. Calls are matched on the request, in recorded order
+        :return: SDK style response
+        :rtype: requests.Response
+        """
+        exact, loose = request_keys(namespace, endpoint, args, kwargs)
+        with self.lock:
+            interaction = self._next(self.exact[exact]) or self._next(self.loose[loose])
+            if not interaction:
+                self.misses += 1
+        if not interaction:
+            log.warning(f"--- {namespace}.{endpoint} {args} is not in the cassette")
+            return make_response(MISS_STATUS, {"_error": [{"code": "CASSETTE_MISS", "message": f"{namespace}.{endpoint} not recorded"}]})
+        if self.speed:
+            time.sleep(interaction["latency"] * self.speed)
+        return make_response(interaction["status"], interaction["content"], interaction.get("headers"))
+
+    def close(self):
+        """ finish the recording
+        """
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+def call_counts(file_name):
+    """ number of calls per endpoint in a cassette
+    :rtype: collections.Counter
+    """
+    with gzip.open(file_name, "rt") as f:
+        f.readline()
+        return Counter(
+            f"{interaction['namespace']}.{interaction['endpoint']}"
+            for interaction in map(json.loads, f)
+        )
+
+if __name__ == "__main__":
+    # python cassette.py <cassette> [<other cassette>]: calls per endpoint, or the difference
+    if len(sys.argv) not in (2, 3):
+        sys.exit(f"Usage: {sys.argv[0]} <cassette> [<other cassette>]")
+    counts = [call_counts(file_name) for file_name in sys.argv[1:]]
+    endpoints = sorted(set().union(*counts))
+    width = max([len("Endpoint")] + [len(endpoint) for endpoint in endpoints])
+    if len(counts) == 1:
+        print(f"{'Endpoint':<{width}}  {'Calls':>7}")
+        for endpoint in endpoints:
+            print(f"{endpoint:<{width}}  {counts[0][endpoint]:>7}")
+        print(f"{'Total':<{width}}  {sum(counts[0].values()):>7}")
+    else:
+        print(f"{'Endpoint':<{width}}  {'Before':>7}  {'After':>7}  {'Diff':>7}")
+        for endpoint in endpoints:
+            before, after = counts[0][endpoint], counts[1][endpoint]
+            print(f"{endpoint:<{width}}  {before:>7}  {after:>7}  {after - before:>+7}")
+        before, after = sum(counts[0].values()), sum(counts[1].values())
+        print(f"{'Total':<{width}}  {before:>7}  {after:>7}  {after - before:>+7}")
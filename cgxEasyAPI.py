@@ -1,20 +1,309 @@
 import cloudgenix
-import ipcalc
 from cloudgenix import jd, jd_detailed
-import cloudgenix_settings
 import logging
 import db
+import transport
+import metrics
+import tracing
 from pprint import pprint as pp
 import sys
+import re
+import ipaddress
+import copy
+import itertools
+import csv
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 #init logging
 log = logging.getLogger('cgxEasyAPI').addHandler(logging.NullHandler())
 
-# init db
+# number of elements per interfaces query and maximum interfaces returned by one query
+INTERFACES_QUERY_CHUNK = 100
+INTERFACES_QUERY_LIMIT = 10000
+# number of sites per anynet links query and maximum anynet links returned by one query
+ANYNETLINKS_QUERY_CHUNK = 20
+ANYNETLINKS_QUERY_LIMIT = 10000
+# default controller URL
+CONTROLLER = "https://api.elcapitan.cloudgenix.com"
+# message of a successful call that had nothing to write
+UNCHANGED = "unchanged"
+
+def subnet_key(subnet):
+    """Normalize a subnet so the same network written differently gives the same key
+    :param subnet: subnet. "10.0.0.0/24" and "10.0.0.1/24" give the same key
+    :type subnet: str
+    :return: the network, or None if subnet is not valid
+    :rtype: ipaddress.IPv4Network
+    """
+    try:
+        return ipaddress.ip_network(subnet, strict=False)
+    except (ValueError, TypeError):
+        return None
+
+def normalize_prefixes(prefixes, aggregate=False):
+    """Validate, normalize and dedup IPv4 prefixes
+    :param prefixes: Prefixes in the form of ip/net_len. Example "10.2.3.0/8" or "13.6.8.5/32"
+    :type prefixes: list
+    :param aggregate: collapse overlapping and adjacent prefixes
+    :type aggregate: bool
+    :return: sorted prefixes or None, ErrMSG
+    :rtype: list, str
+    """
+    networks = set()
+    for prefix in prefixes:
+        try:
+            networks.add(ipaddress.IPv4Network(prefix, strict=False))
+        except (ValueError, TypeError):
+            return None, f"{prefix} is not a valid"
+    if aggregate:
+        networks = ipaddress.collapse_addresses(networks)
+    return [str(network) for network in sorted(networks)], ""
+
+def merge_prefixes(existing, prefixes, aggregate=False):
+    """Merge prefixes into an existing prefix list
+    :param existing: current prefixes. Not modified
+    :type existing: list
+    :param prefixes: prefixes to add. Not modified
+    :type prefixes: list
+    :param aggregate: collapse overlapping and adjacent prefixes
+    :type aggregate: bool
+    :return: merged prefixes or None, number of prefixes added, number of prefixes removed, ErrMSG
+    :rtype: list, int, int, str
+    """
+    new, err = normalize_prefixes(prefixes)
+    if new is None:
+        return None, 0, 0, err
+    # existing prefixes were validated by the controller
+    current, err = normalize_prefixes(existing or [])
+    if current is None:
+        current = list(existing)
+    merged, err = normalize_prefixes(current + new, aggregate=aggregate)
+    if merged is None:
+        return None, 0, 0, err
+    current_set = set(current)
+    merged_set = set(merged)
+    return merged, len(merged_set - current_set), len(current_set - merged_set), ""
+
+def read_prefix_rows(file_name):
+    """Stream prefix rows from a CSV file with prefix_name, site and prefix columns, or
+    from a JSON lines (.jsonl) file
+    :param file_name: file to read
+    :type file_name: str
+    :return: generator of (line number, row dictionary)
+    """
+    with open(file_name, newline="") as f:
+        if file_name.endswith(".jsonl"):
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    yield line_no, json.loads(line)
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, {key: (value or "").strip() for key, value in row.items() if key}
+
+def dhcp_option_name(opt_def):
+    """Extract the definition name of a DHCP option definition
+    :param opt_def: Option defenition
+    :type opt_def: str - option my_43 code 43 = text
+    :return: the definition name - my_43
+    :rtype: str
+    """
+    m = re.search(r'option\s+(\S+)\s+code', opt_def or "")
+    return m.group(1) if m else None
+
+def dhcp_options_apply(custom_options, operations):
+    """Apply option operations to a DHCP server custom option list
+    :param custom_options: current options. Not modified
+    :type custom_options: list
+    :param operations: see cgxEasyAPI.dhcp_pool_update_options
+    :type operations: list of tuples
+    :return: new options list or None, ErrMSG
+    :rtype: list, str
+    """
+    options = list(custom_options)
+    for operation in operations:
+        action = operation[0]
+        if action in ("add", "replace"):
+            try:
+                _, opt_vci, opt_def, opt_val = operation
+            except ValueError:
+                return None, f"{action} needs vci, definition and value"
+            option = {
+                "vendor_class_identifier" : opt_vci,
+                "option_definition": opt_def,
+                "option_value": opt_val
+            }
+            if action == "replace":
+                # replace in place to keep the option order
+                name = dhcp_option_name(opt_def)
+                same = [i for i, o in enumerate(options) if dhcp_option_name(o['option_definition']) == name]
+                if same:
+                    options[same[0]] = option
+                    options = [o for i, o in enumerate(options) if i not in same[1:]]
+                    continue
+            if option not in options:
+                options.append(option)
+        elif action == "remove":
+            if len(operation) != 2:
+                return None, "remove needs the definition name"
+            remaining = [o for o in options if dhcp_option_name(o['option_definition']) != operation[1]]
+            if len(remaining) == len(options):
+                return None, f"Option {operation[1]} not found"
+            options = remaining
+        else:
+            return None, f"Unknown option operation {action}"
+    return options, ""
+
+def index_interfaces(interfaces):
+    """Build the lookup indexes of an element's interfaces
+    :param interfaces: the element interfaces
+    :type interfaces: list
+    :return: name -> interface, id -> interface, parent id -> {id -> child interface}
+        and (parent id, vlan) -> sub interface dictionaries
+    :rtype: dict
+    """
+    index = {'name': {}, 'id': {}, 'children': {}, 'vlan': {}}
+    for interface in interfaces:
+        index_add(index, interface)
+    return index
+
+def index_add(index, interface):
+    """Add an interface to element interface indexes
+    """
+    index['name'][interface['name']] = interface
+    index['id'][interface['id']] = interface
+    if interface.get('parent'):
+        index['children'].setdefault(interface['parent'], {})[interface['id']] = interface
+        if interface.get('sub_interface'):
+            index['vlan'][(interface['parent'], str(interface['sub_interface'].get('vlan_id')))] = interface
+
+def index_remove(index, interface):
+    """Remove an interface from element interface indexes
+    """
+    if index['name'].get(interface['name']) is interface:
+        del index['name'][interface['name']]
+    index['id'].pop(interface['id'], None)
+    if interface.get('parent'):
+        index['children'].get(interface['parent'], {}).pop(interface['id'], None)
+        if interface.get('sub_interface'):
+            key = (interface['parent'], str(interface['sub_interface'].get('vlan_id')))
+            if index['vlan'].get(key) is interface:
+                del index['vlan'][key]
+
+def interface_edits_apply(interface, edits):
+    """Apply edits to an interface
+    :param interface: the interface. Modified in place
+    :type interface: dict
+    :param edits: see cgxEasyAPI.interface_update. DHCP relay sources are interface IDs
+    :type edits: list of tuples
+    :return: names of the edits that changed the interface or None, ErrMSG
+    :rtype: list, str
+    """
+    changed = []
+    for edit in edits:
+        action = edit[0]
+        if action == "tag":
+            if len(edit) != 2:
+                return None, "tag needs the tag"
+            if edit[1] in (interface['tags'] or []):
+                log.info(f"--- Tag {edit[1]} already on interface {interface['name']}")
+                continue
+            interface['tags'] = (interface['tags'] or []) + [edit[1]]
+        elif action == "dhcp_relay":
+            if len(edit) not in (2, 3):
+                return None, "dhcp_relay needs the server IP and optionally the source interface"
+            server_ip = edit[1]
+            if interface['dhcp_relay']:
+                server_ips = interface['dhcp_relay']['server_ips'] or []
+                if server_ip in server_ips:
+                    log.info(f"--- DHCP relay {server_ip} already on interface {interface['name']}")
+                    continue
+                interface['dhcp_relay']['server_ips'] = list(set(server_ips+[server_ip]))
+            else:
+                interface['dhcp_relay']= {
+                    "server_ips": [
+                        server_ip
+                    ],
+                    "enabled": True,
+                    "option_82": {
+                        "enabled": False,
+                        "circuit_id": None,
+                        "remote_id": None,
+                        "reforwarding_policy": "replace"
+                    },
+                    "source_interface": edit[2] if len(edit) > 2 and edit[2] else interface['id']
+                }
+        elif action in ("description", "admin_up"):
+            if len(edit) != 2:
+                return None, f"{action} needs a value"
+            if interface.get(action) == edit[1]:
+                continue
+            interface[action] = edit[1]
+        else:
+            return None, f"Unknown interface edit {action}"
+        changed.append(action)
+    return changed, ""
+
+class InterfaceChangeSet:
+    """Edits to one interface, collected and committed with a single PUT.
+    Get one with cgxEasyAPI.interface_changes()
+    """
+    def __init__(self, easy, element_name, interface_name):
+        self.easy = easy
+        self.element_name = element_name
+        self.interface_name = interface_name
+        self.edits = []
+
+    def add_tag(self, tag):
+        self.edits.append(("tag", tag))
+        return self
+
+    def add_dhcp_relay(self, server_ip, source_interface_name=None):
+        self.edits.append(("dhcp_relay", server_ip, source_interface_name))
+        return self
+
+    def set_description(self, description):
+        self.edits.append(("description", description))
+        return self
+
+    def set_admin_up(self, admin_up):
+        self.edits.append(("admin_up", admin_up))
+        return self
+
+    def commit(self):
+        """Apply the collected edits with a single PUT
+        :return: Success, ErrMSG
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
+        """
+        res, err = self.easy.interface_update(self.element_name, self.interface_name, self.edits)
+        if res:
+            self.edits = []
+        return res, err
 
 class cgxEasyAPI:
-    def __init__(self, auth_token, debug=0, ssl_verify=True):
+    def __init__(self, auth_token, debug=0, ssl_verify=True, cache_ttl=None, refresh_cache=False, pool_size=transport.POOL_SIZE, retry=None, rate_limiter=None, concurrency=None, controller=CONTROLLER, update_check=True, cassette=None):
         """ constrat easyAPI object
+        :param cache_ttl: seconds before the on disk site/element snapshot is refreshed. Default db.CACHE_TTL
+        :type cache_ttl: int
+        :param refresh_cache: ignore the on disk snapshot and fetch sites/elements from the controller
+        :type refresh_cache: bool
+        :param pool_size: number of keep-alive connections to the controller
+        :type pool_size: int
+        :param retry: retry policy overrides per SDK method, see transport.RETRY. Example {"post": {"retries": 2}}
+        :type retry: dict
+        :param rate_limiter: request budget for all API calls. None for no limit
+        :type rate_limiter: ratelimit.RateLimiter
+        :param concurrency: adaptive limit of API calls in flight. None for no limit
+        :type concurrency: concurrency.AIMDLimiter
+        :param controller: controller URL. Use a mock_controller URL for offline runs
+        :type controller: str
+        :param update_check: check PyPI for a newer cloudgenix SDK
+        :type update_check: bool
+        :param cassette: record all API calls, or replay them without logging in or using the network
+        :type cassette: cassette.Cassette
         """
         # init logging
         cloudgenix.api_logger.setLevel(logging.WARN)
@@ -26,35 +315,224 @@ class cgxEasyAPI:
         log = logging.getLogger("cgxEasyAPI")
 
         # init API
-        sdk = cloudgenix.API(ssl_verify=ssl_verify)
-        res = sdk.interactive.use_token(auth_token)
-        if not res:
-            log.critical("Can't Login. Check authtoken")
-            jd_detailed(res)
-            sys.exit()
+        if cassette and cassette.replaying:
+            # the recorded tenant, no login
+            sdk = cloudgenix.API(controller=cassette.controller, ssl_verify=ssl_verify, update_check=False)
+            sdk.tenant_id = cassette.tenant_id
+        else:
+            sdk = cloudgenix.API(controller=controller, ssl_verify=ssl_verify, update_check=update_check)
+            res = sdk.interactive.use_token(auth_token)
+            if not res:
+                log.critical("Can't Login. Check authtoken")
+                jd_detailed(res)
+                sys.exit()
+            if cassette:
+                cassette.start(sdk)
 
-        self.sdk = sdk
+        self.sdk = transport.Transport(sdk, pool_size=pool_size, retry=retry, rate_limiter=rate_limiter, concurrency=concurrency, cassette=cassette)
         self.debug = debug
-        self.interfaces = {} # interface cache
-        db.init(sdk)
+        self.interfaces = {} # interface cache. element id -> interfaces
+        self.interface_index = {} # element id -> interface indexes, see index_interfaces
+        self.dhcpservers = {} # dhcp server cache. site id -> subnet_key -> dhcp server
+        self.zone_bindings = {} # zone bindings cache of prefetched elements. element id -> zone bindings
+        self.snmpagents = {} # SNMP agents cache of prefetched elements. element id -> SNMP agents
+        self.prefix_lock = threading.Lock() # serializes prefixlist creation
+        # cassette runs always fetch the tables so recordings replay the same calls
+        db.init(self.sdk, cache_file=None if cassette else False, cache_ttl=cache_ttl, refresh=refresh_cache)
     
+    def set_connection_pool(self, pool_size):
+        """Resize the HTTP connection pool so pool_size requests can be in flight without
+        opening and closing connections
+        :param pool_size: number of keep-alive connections to the controller
+        :type pool_size: int
+        """
+        self.sdk.set_pool_size(pool_size)
+
+    @metrics.timed
+    @tracing.traced
     def build_interfaces_cache(self, site_id, element_id):
         """Build interfaces cache 
         :param site_id: The site ID of the element 
         :param type: str
         :param element_id: The element for which we need the interface list for
         :param type: str
+        :return: Success, ErrMSG
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
         """
         # shortcut
-        interfaces = self.interfaces
         sdk = self.sdk
 
         # get the list of interfaces for the element
         res = sdk.get.interfaces(site_id, element_id)
         if not res:
-            jd_detailed(res)
-            sys.exit()
-        interfaces[element_id] = res.cgx_content["items"]
+            err = f"--- Can't get interfaces: {sdk.pull_content_error(res)}"
+            log.error(err)
+            if self.debug:
+                jd_detailed(res)
+            return False, err
+        self.set_interfaces(element_id, res.cgx_content["items"])
+        return True, ""
+
+    @metrics.timed
+    @tracing.traced
+    def prefetch_interfaces(self, element_names, max_workers=8):
+        """Warm the interfaces cache for many elements up front.
+        Interfaces are pulled with the tenant wide interfaces query, elements the query
+        didn't fully return are fetched one by one in parallel.
+        :param element_names: names of the elements to prefetch
+        :type element_names: list
+        :param max_workers: number of parallel per element fetches
+        :type max_workers: int
+        :return: Success, ErrMSG
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
+        """
+        # skip unknown elements and elements already in the cache
+        elements = {}
+        for element_name in element_names:
+            element = db.fetch("name2element", element_name)
+            if element and element['id'] not in self.interfaces:
+                elements[element['id']] = element
+        if not elements:
+            return True, ""
+
+        # query interfaces in chunks of elements
+        missing = []
+        element_ids = list(elements)
+        for i in range(0, len(element_ids), INTERFACES_QUERY_CHUNK):
+            chunk = element_ids[i:i+INTERFACES_QUERY_CHUNK]
+            if not self._query_interfaces(chunk):
+                missing.extend(elements[element_id] for element_id in chunk)
+
+        # fall back to per element fetches
+        failed = []
+        def fetch(element):
+            res = self.sdk.get.interfaces(element['site_id'], element['id'])
+            if not res:
+                failed.append(element['name'])
+                return
+            self.set_interfaces(element['id'], res.cgx_content["items"])
+        if missing:
+            log.info(f"--- Fetching interfaces for {len(missing)} elements one by one")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(tracing.bind(fetch), missing))
+        if failed:
+            return False, f"Can't fetch interfaces for {', '.join(failed)}"
+        return True, ""
+
+    def _query_interfaces(self, element_ids):
+        """Fill the interfaces cache for element_ids with a single interfaces query
+        :return: True if all interfaces of all elements were returned
+        :rtype: bool
+        """
+        data = {
+            "limit": INTERFACES_QUERY_LIMIT,
+            "query_params": {"element_id": {"in": element_ids}}
+        }
+        res = self.sdk.post.interfaces_query(data)
+        if not res:
+            return False
+        items = res.cgx_content.get("items") or []
+        total_count = res.cgx_content.get("total_count", len(items))
+        if len(items) < total_count or any('element_id' not in item for item in items):
+            return False
+
+        found = {element_id: [] for element_id in element_ids}
+        for item in items:
+            if item['element_id'] in found:
+                found[item['element_id']].append(item)
+        for element_id, element_interfaces in found.items():
+            self.set_interfaces(element_id, element_interfaces)
+        return True
+
+    def cache_interface(self, site_id, element_id, res, interface_id=None):
+        """Write an interface PUT/POST response through to the interfaces cache.
+        The element's interfaces are fetched again if the response isn't a complete interface
+        :param site_id: The site ID of the element
+        :type site_id: str
+        :param element_id: The element ID
+        :type element_id: str
+        :param res: the PUT/POST response
+        :type res: requests.Response
+        :param interface_id: the ID of the updated interface. None for a new interface
+        :type interface_id: str
+        """
+        interface = res.cgx_content if isinstance(res.cgx_content, dict) else {}
+        interfaces = self.interfaces.get(element_id)
+        if interfaces is None or not interface.get('id') or '_etag' not in interface or not interface.get('name') or \
+            (interface_id and interface['id'] != interface_id):
+            log.info(f"--- Interface response incomplete, fetching interfaces of element {element_id}")
+            res, err = self.build_interfaces_cache(site_id, element_id)
+            if not res:
+                self.drop_interfaces(element_id)
+            return
+        index = self.interface_index[element_id]
+        cached = index['id'].get(interface['id'])
+        if cached:
+            index_remove(index, cached)
+            interfaces[interfaces.index(cached)] = interface
+        else:
+            interfaces.append(interface)
+        index_add(index, interface)
+
+    def set_interfaces(self, element_id, interfaces):
+        """Replace the cached interfaces of an element and rebuild their indexes
+        :param element_id: The element ID
+        :type element_id: str
+        :param interfaces: the element interfaces
+        :type interfaces: list
+        """
+        self.interface_index[element_id] = index_interfaces(interfaces)
+        self.interfaces[element_id] = interfaces
+
+    def drop_interfaces(self, element_id):
+        """Remove the interfaces of an element from the cache, they are fetched again on next use
+        :param element_id: The element ID
+        :type element_id: str
+        """
+        self.interfaces.pop(element_id, None)
+        self.interface_index.pop(element_id, None)
+
+    def get_interface(self, site_id, element_id, name=None, id=None, parent_id=None, vlan=None):
+        """Find an interface in the cache by name, by ID or by parent ID and VLAN.
+        The cache is built if needed
+        :param site_id: The site ID of the element
+        :type site_id: str
+        :param element_id: The element ID
+        :type element_id: str
+        :param name: interface name
+        :type name: str
+        :param id: interface ID
+        :type id: str
+        :param parent_id: ID of the parent of a sub interface, together with vlan
+        :type parent_id: str
+        :param vlan: VLAN ID of a sub interface
+        :type vlan: int
+        :return: the cached interface or None, ErrMSG. ErrMSG is empty if the interface wasn't found
+        :rtype interface: dict
+        :rtype ErrMSG: String
+        """
+        interfaces, err = self.get_interfaces(site_id, element_id)
+        if interfaces is None:
+            return None, err
+        index = self.interface_index[element_id]
+        if name is not None:
+            return index['name'].get(name), ""
+        if id is not None:
+            return index['id'].get(id), ""
+        return index['vlan'].get((parent_id, str(vlan))), ""
+
+    def get_interface_children(self, site_id, element_id, parent_id):
+        """Sub interfaces and other interfaces with parent_id as their parent
+        :return: list of interfaces or None, ErrMSG
+        :rtype interfaces: list
+        :rtype ErrMSG: String
+        """
+        interfaces, err = self.get_interfaces(site_id, element_id)
+        if interfaces is None:
+            return None, err
+        return list(self.interface_index[element_id]['children'].get(parent_id, {}).values()), ""
 
     def get_interfaces(self, site_id, element_id):
         """Returns interfaces from the cache. If the cache is empty, the cache will be recreated
@@ -62,64 +540,243 @@ class cgxEasyAPI:
         :param type: str
         :param element_id: The element for which we need the interface list for
         :param type: str
-        :return interface list: A list with all the interfaces configured for the element
-        :rtype list:
+        :return: A list with all the interfaces configured for the element or None, ErrMSG
+        :rtype interfaces: list
+        :rtype ErrMSG: String
         """
         # shortcut
         interfaces = self.interfaces
 
         # check if we have a cache entry
         if not element_id in interfaces:
-            self.build_interfaces_cache(site_id, element_id)
+            res, err = self.build_interfaces_cache(site_id, element_id)
+            if not res:
+                return None, err
         
-        return interfaces[element_id]
+        return interfaces[element_id], ""
 
-    def dhcp_pool_del_option(self, site_name, subnet, opt_def_name):
-        """Add dhcp pool option
-        :param site_name: The site to add the option to.
+    @metrics.timed
+    @tracing.traced
+    def build_dhcpservers_cache(self, site_id):
+        """Build DHCP servers cache for a site
+        :param site_id: The site ID
         :param type: str
-        :param subnet: IPv4 subnet. This will be used to indetify
+        :return: Success, ErrMSG
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
+        """
+        sdk = self.sdk
+
+        res = sdk.get.dhcpservers(site_id)
+        if not res:
+            err = f"--- Can't get DHCP servers: {sdk.pull_content_error(res)}"
+            log.error(err)
+            if self.debug:
+                jd_detailed(res)
+            return False, err
+        self.dhcpservers[site_id] = {
+            subnet_key(dhcpserver['subnet']): dhcpserver
+            for dhcpserver in res.cgx_content['items']
+        }
+        return True, ""
+
+    def get_dhcpserver(self, site_id, subnet):
+        """Return a copy of the DHCP server of a subnet from the cache. If the cache is empty, the cache will be recreated
+        :param site_id: The site ID
+        :param type: str
+        :param subnet: IPv4 subnet, any address inside the subnet can be used
         :param type: str - 10.0.0.0/24
-        :param opt_def_name: Option defenition. In the following option "option my_43 code 43 = text" the definiton name is "my_43"   
-        :param type: str - my_43
+        :return: DHCP server, ErrMSG
+        :rtype DHCP server: dict
+        :rtype ErrMSG: String
+        """
+        key = subnet_key(subnet)
+        if not key:
+            return None, f"{subnet} is not a valid subnet"
+
+        if site_id not in self.dhcpservers:
+            res, err = self.build_dhcpservers_cache(site_id)
+            if not res:
+                return None, err
+
+        dhcpserver = self.dhcpservers[site_id].get(key)
+        if not dhcpserver:
+            return None, "DHCP subnet not found"
+        # callers modify the server before updating it, keep the cache clean until the update succeeds
+        return copy.deepcopy(dhcpserver), ""
+
+    @metrics.timed
+    @tracing.traced
+    def build_zone_bindings_cache(self, site_id, element_id):
+        """Build the zone bindings cache for an element
+        :param site_id: The site ID of the element
+        :param type: str
+        :param element_id: The element ID
+        :param type: str
         :return: Success, ErrMSG
         :rtype Success: Boolean
         :rtype ErrMSG: String
         """
-        # shortcut
         sdk = self.sdk
 
-        # get site info
-        site = db.fetch("name2site", site_name)
-        if not site:
-            return False, "Site not found"
+        res = sdk.get.elementsecurityzones(site_id, element_id)
+        if not res:
+            err = f"--- Can't get zone bindings: {sdk.pull_content_error(res)}"
+            log.error(err)
+            if self.debug:
+                jd_detailed(res)
+            return False, err
+        self.zone_bindings[element_id] = res.cgx_content['items']
+        return True, ""
 
-        # find the dhcp scoped
-        for dhcpserver in sdk.get.dhcpservers(site['id']).cgx_content['items']:
-            if dhcpserver['subnet'] == subnet:
-                break 
-        else:
-            return False, "DHCP subnet not found"
-        
-        # find the options
-        for option in dhcpserver['custom_options']:
-            if f"option {opt_def_name} code" in option['option_definition']:
-                break
-        else:
-            return False, "Option not found"
+    def get_zone_bindings(self, site_id, element_id):
+        """Return a copy of the zone bindings of an element from the cache. Only elements warmed with
+        prefetch_element_config are cached, other elements are read from the controller
+        :param site_id: The site ID of the element
+        :param type: str
+        :param element_id: The element ID
+        :param type: str
+        :return: zone bindings, ErrMSG
+        :rtype zone bindings: list
+        :rtype ErrMSG: String
+        """
+        if element_id in self.zone_bindings:
+            return copy.deepcopy(self.zone_bindings[element_id]), ""
+        res, err = self.build_zone_bindings_cache(site_id, element_id)
+        if not res:
+            return None, err
+        return self.zone_bindings.pop(element_id), ""
+
+    @metrics.timed
+    @tracing.traced
+    def build_snmpagents_cache(self, site_id, element_id):
+        """Build the SNMP agents cache for an element
+        :param site_id: The site ID of the element
+        :param type: str
+        :param element_id: The element ID
+        :param type: str
+        :return: Success, ErrMSG
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
+        """
+        sdk = self.sdk
 
-        # remove the option
-        dhcpserver['custom_options'].remove(option)
-        res = sdk.put.dhcpservers(site['id'], dhcpserver['id'], dhcpserver)
+        res = sdk.get.snmpagents(site_id, element_id)
         if not res:
-            err = f"--- Can't remove DHCP option: {sdk.pull_content_error(res)}"
+            err = f"--- Can't get SNMP agents: {sdk.pull_content_error(res)}"
             log.error(err)
             if self.debug:
                 jd_detailed(res)
             return False, err
+        self.snmpagents[element_id] = res.cgx_content['items']
+        return True, ""
 
+    def get_snmpagents(self, site_id, element_id):
+        """Return a copy of the SNMP agents of an element from the cache. Only elements warmed with
+        prefetch_element_config are cached, other elements are read from the controller
+        :param site_id: The site ID of the element
+        :param type: str
+        :param element_id: The element ID
+        :param type: str
+        :return: SNMP agents, ErrMSG
+        :rtype SNMP agents: list
+        :rtype ErrMSG: String
+        """
+        if element_id in self.snmpagents:
+            return copy.deepcopy(self.snmpagents[element_id]), ""
+        res, err = self.build_snmpagents_cache(site_id, element_id)
+        if not res:
+            return None, err
+        return self.snmpagents.pop(element_id), ""
+
+    def cache_element_item(self, cache, element_id, item_id, res):
+        """Write a PUT/POST/DELETE of an element level object through to its cache
+        (self.zone_bindings or self.snmpagents). The element's objects are fetched again
+        on next use if the response isn't a complete object
+        :param cache: element id -> objects
+        :type cache: dict
+        :param element_id: The element ID
+        :type element_id: str
+        :param item_id: the ID of the changed object. None for a new object
+        :type item_id: str
+        :param res: the PUT/POST response. None for a deleted object
+        :type res: requests.Response
+        """
+        items = cache.get(element_id)
+        if items is None:
+            return
+        if res is None:
+            cache[element_id] = [item for item in items if item['id'] != item_id]
+            return
+        new_item = res.cgx_content if isinstance(res.cgx_content, dict) else {}
+        if not new_item.get('id') or '_etag' not in new_item or (item_id and new_item['id'] != item_id):
+            cache.pop(element_id, None)
+            return
+        cache[element_id] = [item for item in items if item['id'] != new_item['id']] + [new_item]
+
+    def clear_element_config(self):
+        """Drop the zone bindings and SNMP agents caches, later calls read the controller
+        """
+        self.zone_bindings = {}
+        self.snmpagents = {}
+
+    @metrics.timed
+    @tracing.traced
+    def prefetch_element_config(self, element_names, zone_bindings=True, snmpagents=True, max_workers=8):
+        """Warm the zone bindings and SNMP agents caches for many elements up front, in parallel.
+        The cached objects are used until clear_element_config, call it when the batch of changes is done
+        :param element_names: names of the elements to prefetch
+        :type element_names: list
+        :param zone_bindings: prefetch zone bindings
+        :type zone_bindings: bool
+        :param snmpagents: prefetch SNMP agents
+        :type snmpagents: bool
+        :param max_workers: number of parallel fetches
+        :type max_workers: int
+        :return: Success, ErrMSG
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
+        """
+        jobs = []
+        for element_name in element_names:
+            element = db.fetch("name2element", element_name)
+            if not element:
+                continue
+            if zone_bindings and element['id'] not in self.zone_bindings:
+                jobs.append((self.build_zone_bindings_cache, element))
+            if snmpagents and element['id'] not in self.snmpagents:
+                jobs.append((self.build_snmpagents_cache, element))
+        if not jobs:
+            return True, ""
+
+        def fetch(job):
+            build, element = job
+            res, err = build(element['site_id'], element['id'])
+            return None if res else f"{element['name']}: {err}"
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            errors = [err for err in executor.map(tracing.bind(fetch), jobs) if err]
+        if errors:
+            return False, "; ".join(errors)
         return True, ""
 
+    @metrics.timed
+    @tracing.traced
+    def dhcp_pool_del_option(self, site_name, subnet, opt_def_name):
+        """Add dhcp pool option
+        :param site_name: The site to add the option to.
+        :param type: str
+        :param subnet: IPv4 subnet. This will be used to indetify
+        :param type: str - 10.0.0.0/24
+        :param opt_def_name: Option defenition. In the following option "option my_43 code 43 = text" the definiton name is "my_43"   
+        :param type: str - my_43
+        :return: Success, ErrMSG
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
+        """
+        return self.dhcp_pool_update_options(site_name, subnet, [("remove", opt_def_name)])
+
+    @metrics.timed
+    @tracing.traced
     def dhcp_pool_add_option(self, site_name, subnet, opt_vci, opt_def, opt_val):
         """Add dhcp pool option
         :param site_name: The site to add the option to.
@@ -136,6 +793,26 @@ class cgxEasyAPI:
         :rtype Success: Boolean
         :rtype ErrMSG: String
         """
+        return self.dhcp_pool_update_options(site_name, subnet, [("add", opt_vci, opt_def, opt_val)])
+
+    @metrics.timed
+    @tracing.traced
+    def dhcp_pool_update_options(self, site_name, subnets, operations):
+        """Apply a list of option changes to one or more DHCP pools with a single update per pool.
+        Pools where the changes don't modify the options are not updated.
+        :param site_name: The site of the pools
+        :param type: str
+        :param subnets: IPv4 subnet or list of subnets of the pools to change
+        :param type: str or list - 10.0.0.0/24
+        :param operations: changes applied in order:
+            ("add", opt_vci, opt_def, opt_val) - add an option
+            ("replace", opt_vci, opt_def, opt_val) - replace the option with the same definition name, or add it
+            ("remove", opt_def_name) - remove the option with the definition name
+        :param type: list of tuples
+        :return: Success, ErrMSG
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
+        """
         # shortcut
         sdk = self.sdk
 
@@ -144,36 +821,49 @@ class cgxEasyAPI:
         if not site:
             return False, "Site not found"
 
-        # find the dhcp scoped
-        for dhcpserver in sdk.get.dhcpservers(site['id']).cgx_content['items']:
-            if dhcpserver['subnet'] == subnet:
-                break 
-        else:
-            return False, "DHCP subnet not found"
-        
-        # if not options alread configure, create an empty list
-        if not dhcpserver['custom_options']:
-            dhcpserver['custom_options'] = []
-        
-        # add option 
-        dhcpserver['custom_options'].append(
-            {
-                "vendor_class_identifier" : opt_vci,
-                "option_definition": opt_def,
-                "option_value": opt_val
-            }
-        )
+        if isinstance(subnets, str):
+            subnets = [subnets]
 
-        res = sdk.put.dhcpservers(site['id'], dhcpserver['id'], dhcpserver)
-        if not res:
-            err = f"--- Can't add DHCP option: {sdk.pull_content_error(res)}"
-            log.error(err)
-            if self.debug:
-                jd_detailed(res)
-            return False, err
+        errors = []
+        unchanged = 0
+        for subnet in subnets:
+            # find the dhcp scoped
+            dhcpserver, err = self.get_dhcpserver(site['id'], subnet)
+            if not dhcpserver:
+                errors.append(f"{subnet}: {err}")
+                continue
+
+            # compute the new option list
+            custom_options, err = dhcp_options_apply(dhcpserver['custom_options'] or [], operations)
+            if custom_options is None:
+                errors.append(f"{subnet}: {err}")
+                continue
+            if custom_options == (dhcpserver['custom_options'] or []):
+                log.info(f"--- DHCP options of {subnet} unchanged")
+                unchanged += 1
+                continue
+
+            dhcpserver['custom_options'] = custom_options
+            res = sdk.put.dhcpservers(site['id'], dhcpserver['id'], dhcpserver)
+            if not res:
+                err = f"--- Can't update DHCP options of {subnet}: {sdk.pull_content_error(res)}"
+                log.error(err)
+                if self.debug:
+                    jd_detailed(res)
+                errors.append(err)
+                # the cached server may be stale (_etag conflict), read the site's servers again on next use
+                self.dhcpservers.pop(site['id'], None)
+                continue
+            self.dhcpservers.get(site['id'], {})[subnet_key(subnet)] = res.cgx_content if res.cgx_content.get('id') else dhcpserver
 
+        if errors:
+            return False, "; ".join(errors)
+        if unchanged == len(subnets):
+            return True, UNCHANGED
         return True, ""
-        
+
+    @metrics.timed
+    @tracing.traced
     def dhcp_pool_delete(self, site_name, subnet):
         """Delete DHCP pool
         :param site_name: the site name from where to delete the DHCP pool
@@ -193,11 +883,9 @@ class cgxEasyAPI:
             return False, "Site not found"
 
         # find the dhcp scoped
-        for dhcpserver in sdk.get.dhcpservers(site['id']).cgx_content['items']:
-            if dhcpserver['subnet'] == subnet:
-                break 
-        else:
-            return False, "DHCP subnet not found"
+        dhcpserver, err = self.get_dhcpserver(site['id'], subnet)
+        if not dhcpserver:
+            return False, err
         
         # delete DHCP scope
         log.info(f"Deleting DHCP scope of subnet {subnet} at site {site_name}")
@@ -207,10 +895,15 @@ class cgxEasyAPI:
             log.error(err)
             if self.debug:
                 jd_detailed(res)
+            # the cached server may be stale, read the site's servers again on next use
+            self.dhcpservers.pop(site['id'], None)
             return False, err
+        self.dhcpservers.get(site['id'], {}).pop(subnet_key(subnet), None)
 
         return True, ""
 
+    @metrics.timed
+    @tracing.traced
     def interface_tag_add(self, element_name, interface_name, tag):
         """Add tag to an interface
         :param element_name: The name of the ION device
@@ -223,42 +916,10 @@ class cgxEasyAPI:
         :rtype Success: Boolean
         :rtype ErrMSG: String
         """
-        # shortcut
-        sdk = self.sdk
-
-        # get ION from cache and get interface list
-        element = db.fetch("name2element", element_name)
-        if not element:
-            return False, "Can't find element"
-        interfaces = self.get_interfaces(element['site_id'], element['id'])
-
-        # find interface name 
-        for interface in interfaces:
-            if interface['name'] == interface_name:
-                break
-        else:
-            return False, "Can't find interface"
-        
-        if interface['tags'] == None:
-            interface['tags'] = []
-
-        if tag in interface['tags']:
-            return False, "tag already exists"
-        
-        interface['tags'].append(tag)
-        res = sdk.put.interfaces(element['site_id'], element['id'], interface['id'], interface)
-        if not res:
-            err = f"--- Can't add tag: {sdk.pull_content_error(res)}"
-            log.error(err)
-            if self.debug:
-                jd_detailed(res)
-            return False, err
-
-        # refresh interfaces for the elemnt as we changed an attribute
-        self.build_interfaces_cache(element['site_id'], element['id'])
-
-        return True, ""
+        return self.interface_update(element_name, interface_name, [("tag", tag)])
 
+    @metrics.timed
+    @tracing.traced
     def set_interface_zone(self, element_name, interface_name, zone_name):
         """ Place an interface into a zone. 
         If an interface is already in a zone, th escript will pull it out of that zone
@@ -279,35 +940,39 @@ class cgxEasyAPI:
         element = db.fetch("name2element", element_name)
         if not element:
             return False, "Can't find element"
-        interfaces = self.get_interfaces(element['site_id'], element['id'])
 
         # find interface name 
-        for interface in interfaces:
-            if interface['name'] == interface_name:
-                break
-        else:
-            return False, "Can't find interface"
-
-        # create a security zone database
-        securityzones = sdk.get.securityzones().cgx_content['items']
-        name2zone = {}
-        zone2name = {}
-        for securityzone in securityzones:
-            name2zone[securityzone['name']] = securityzone
-            zone2name[securityzone['id']] = securityzone
-        
-        if zone_name not in name2zone:
+        interface, err = self.get_interface(element['site_id'], element['id'], name=interface_name)
+        if not interface:
+            return False, err or "Can't find interface"
+
+        # get the zone from the security zone catalog. The zone may be newer than the catalog
+        with tracing.span("zone catalog", zone=zone_name):
+            zone = db.fetch("name2zone", zone_name)
+            if not zone and db.refetch("name2zone"):
+                zone = db.fetch("name2zone", zone_name)
+            zone2name = db.get_table("id2zone")
+        if not zone:
             return False, f"Can't find zone {zone_name}"
-        else:
-            zone = name2zone[zone_name]
-        
+
         # check if interface already assign into a zone
-        zone_bindings  = sdk.get.elementsecurityzones(element['site_id'], element['id']).cgx_content['items']
+        moved = False
+        with tracing.span("zone bindings fetch", element=element_name):
+            zone_bindings, err = self.get_zone_bindings(element['site_id'], element['id'])
+            if zone_bindings is None:
+                return False, err
+            if any(zone_binding['zone_id'] not in zone2name for zone_binding in zone_bindings) and db.refetch("id2zone"):
+                zone2name = db.get_table("id2zone")
+            # zones still missing from the catalog are shown by ID
+            unknown = {zone_binding['zone_id'] for zone_binding in zone_bindings} - zone2name.keys()
+            if unknown:
+                zone2name = dict(zone2name, **{zone_id: {"name": zone_id} for zone_id in unknown})
         for zone_binding in zone_bindings:
             if zone_binding['zone_id'] == zone['id']:
                 continue
             if zone_binding['interface_ids'] and interface['id'] in zone_binding['interface_ids']:
                 log.info(f"--- Interface found in zone {zone2name[zone_binding['zone_id']]['name']}")
+                moved = True
                 # remove the interface and update the zone binding
                 zone_binding['interface_ids'].remove(interface['id'])
                 if zone_binding['interface_ids'] == []:
@@ -319,23 +984,31 @@ class cgxEasyAPI:
                     zone_binding['wanoverlay_ids'] == None:
                     # delete zone_binding
                     log.info(f"--- After removing interface from zone {zone2name[zone_binding['zone_id']]['name']} there are no binding left. Deleting the binding")
-                    res = sdk.delete.elementsecurityzones(element['site_id'], element['id'], zone_binding['id'])
+                    with tracing.span("zone binding delete", zone=zone2name[zone_binding['zone_id']]['name']):
+                        res = sdk.delete.elementsecurityzones(element['site_id'], element['id'], zone_binding['id'])
                     if not res:
                         err = f"--- Can't delete zone binding {zone2name[zone_binding['zone_id']]['name']}: {sdk.pull_content_error(res)}"
                         log.error(err)
                         if self.debug:
                             jd_detailed(res)
+                        # the controller copy may have changed, read it again on next use
+                        self.zone_bindings.pop(element['id'], None)
                         return False, err
+                    self.cache_element_item(self.zone_bindings, element['id'], zone_binding['id'], None)
                 else:
                     # update the zone_binding
                     log.info(f"--- Removing interface from zone {zone2name[zone_binding['zone_id']]['name']}")
-                    res = sdk.put.elementsecurityzones(element['site_id'], element['id'], zone_binding['id'], zone_binding)
+                    with tracing.span("zone binding update", zone=zone2name[zone_binding['zone_id']]['name']):
+                        res = sdk.put.elementsecurityzones(element['site_id'], element['id'], zone_binding['id'], zone_binding)
                     if not res:
                         err = f"--- Can't update zone binding for {zone2name[zone_binding['zone_id']]['name']}: {sdk.pull_content_error(res)}"
                         log.error(err)
                         if self.debug:
                             jd_detailed(res)
+                        # the controller copy may have changed, read it again on next use
+                        self.zone_bindings.pop(element['id'], None)
                         return False, err
+                    self.cache_element_item(self.zone_bindings, element['id'], zone_binding['id'], res)
 
         # find existing zone bindings. If found, just add the interface and update, else create a new zone binding
         for zone_binding in zone_bindings:
@@ -347,17 +1020,21 @@ class cgxEasyAPI:
                     # check if interface already there
                     if interface['id'] in zone_binding['interface_ids']:
                         log.info(f"--- Interface {interface['name']} already bound to zone {zone_name}")
-                        return True, "interface already bound"
+                        return True, "" if moved else UNCHANGED
                     zone = zone_binding['interface_ids'].append(interface['id'])
                 # update the zone_binding
                 log.info(f"--- Adding interface {interface['name']} to zone {zone_name}")
-                res = sdk.put.elementsecurityzones(element['site_id'], element['id'], zone_binding['id'], zone_binding)
+                with tracing.span("zone binding update", zone=zone_name):
+                    res = sdk.put.elementsecurityzones(element['site_id'], element['id'], zone_binding['id'], zone_binding)
                 if not res:
                     err = f"--- Can't update zone binding for {zone_name}: {sdk.pull_content_error(res)}"
                     log.error(err)
                     if self.debug:
                         jd_detailed(res)
+                    # the controller copy may have changed, read it again on next use
+                    self.zone_bindings.pop(element['id'], None)
                     return False, err
+                self.cache_element_item(self.zone_bindings, element['id'], zone_binding['id'], res)
                 break
         else:
             # create a new zone binding and post
@@ -368,16 +1045,22 @@ class cgxEasyAPI:
                 "interface_ids": [interface['id']],
                 "wanoverlay_ids": [],"waninterface_ids": []
             }
-            res = sdk.post.elementsecurityzones(element['site_id'], element['id'], zone_binding)
+            with tracing.span("zone binding create", zone=zone_name):
+                res = sdk.post.elementsecurityzones(element['site_id'], element['id'], zone_binding)
             if not res:
                 err = f"--- Can't create zone bindings for {zone_name}: {sdk.pull_content_error(res)}"
                 log.error(err)
                 if self.debug:
                     jd_detailed(res)
+                # the controller copy may have changed, read it again on next use
+                self.zone_bindings.pop(element['id'], None)
                 return False, err
+            self.cache_element_item(self.zone_bindings, element['id'], None, res)
 
         return True, ""
 
+    @metrics.timed
+    @tracing.traced
     def interface_dhcprelay_add(self, element_name, interface_name, dhcprelay_ip, source_interface_name=None):
         """Add DHCP relay server to an interface
         :param element_name: The name of the ION device
@@ -392,6 +1075,26 @@ class cgxEasyAPI:
         :rtype Success: Boolean
         :rtype ErrMSG: String
         """
+        return self.interface_update(element_name, interface_name, [("dhcp_relay", dhcprelay_ip, source_interface_name)])
+
+    @metrics.timed
+    @tracing.traced
+    def interface_update(self, element_name, interface_name, edits):
+        """Apply several edits to an interface with a single PUT
+        :param element_name: The name of the ION device
+        :type element_name: str
+        :param interface_name: The name of the interface
+        :type interface_name: str
+        :param edits: list of edits, applied in order:
+            ("tag", "<tag>") - add a tag
+            ("dhcp_relay", "<server ip>", "<source interface name or None>") - add a DHCP relay server
+            ("description", "<description>") - set the description
+            ("admin_up", True|False) - set the admin state
+        :type edits: list of tuples
+        :return: Success, ErrMSG
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
+        """
         # shortcut
         sdk = self.sdk
 
@@ -399,45 +1102,31 @@ class cgxEasyAPI:
         element = db.fetch("name2element", element_name)
         if not element:
             return False, "Can't find element"
-        interfaces = self.get_interfaces(element['site_id'], element['id'])
 
-        # find interface name 
-        for interface in interfaces:
-            if interface['name'] == interface_name:
-                break
-        else:
-            return False, "Can't find interface"
-        
-        # find source_interface
-        if source_interface_name:
-            for source_interface in interfaces:
-                if source_interface['name'] == source_interface_name:
-                    break
-            else:
-                return False, "Can't find source interface name"
-        else:
-            source_interface = None
+        # find interface name
+        interface, err = self.get_interface(element['site_id'], element['id'], name=interface_name)
+        if not interface:
+            return False, err or "Can't find interface"
+
+        # DHCP relay source interface names to IDs
+        resolved = []
+        for edit in edits:
+            if edit[0] == "dhcp_relay" and len(edit) > 2 and edit[2]:
+                source_interface, err = self.get_interface(element['site_id'], element['id'], name=edit[2])
+                if not source_interface:
+                    return False, err or "Can't find source interface name"
+                edit = (edit[0], edit[1], source_interface['id'])
+            resolved.append(edit)
+
+        # change a copy, the cache is updated from the controller response
+        interface = copy.deepcopy(interface)
+        changed, err = interface_edits_apply(interface, resolved)
+        if changed is None:
+            return False, err
+        if not changed:
+            log.info(f"--- Interface {interface_name} unchanged")
+            return True, UNCHANGED
 
-        
-        # if DHCP server list is empty, create new entry if not, add the server to the list
-        if interface['dhcp_relay']:
-            interface['dhcp_relay']['server_ips'] = list(set(interface['dhcp_relay']['server_ips']+[dhcprelay_ip]))
-        else:
-            source_interface_id = interface['id'] if not source_interface else source_interface['id']
-            interface['dhcp_relay']= {
-                "server_ips": [
-                    dhcprelay_ip
-                ],
-                "enabled": True,
-                "option_82": {
-                    "enabled": False,
-                    "circuit_id": None,
-                    "remote_id": None,
-                    "reforwarding_policy": "replace"
-                },
-                "source_interface": source_interface_id
-            }
-        
         # update the interface
         res = sdk.put.interfaces(element['site_id'], element['id'], interface['id'], interface)
         if not res:
@@ -445,13 +1134,28 @@ class cgxEasyAPI:
             log.error(err)
             if self.debug:
                 jd_detailed(res)
+            # the cached interface may be stale, for example its _etag
+            self.drop_interfaces(element['id'])
             return False, err
-        
-        # refresh interfaces for the elemnt as we changed an attribute
-        self.build_interfaces_cache(element['site_id'], element['id'])
-        log.info("DHCP relay added")
+
+        # write the updated interface through to the cache
+        self.cache_interface(element['site_id'], element['id'], res, interface['id'])
+        log.info(f"--- Interface {interface_name} updated: {', '.join(changed)}")
         return True, ""
 
+    def interface_changes(self, element_name, interface_name):
+        """Start a change set that collects edits to an interface and commits them with a single PUT
+        :param element_name: The name of the ION device
+        :type element_name: str
+        :param interface_name: The name of the interface
+        :type interface_name: str
+        :return: change set
+        :rtype: InterfaceChangeSet
+        """
+        return InterfaceChangeSet(self, element_name, interface_name)
+
+    @metrics.timed
+    @tracing.traced
     def set_snmpv3_agent(self, element_name, user_name, security_level, engine_id, auth_phrase, auth_type, enc_phrase, enc_type):
         """ update or create SNMPv3 agent
         :param element_name: the device to set snmpv3 agent for
@@ -483,7 +1187,9 @@ class cgxEasyAPI:
             return False, "Can't find element"
         
         # get existing SNMP configuration
-        snmpagents = sdk.get.snmpagents(element['site_id'], element['id']).cgx_content['items']
+        snmpagents, err = self.get_snmpagents(element['site_id'], element['id'])
+        if snmpagents is None:
+            return False, err
 
         # if no configuration found, create a new one
         if snmpagents == []:
@@ -515,7 +1221,10 @@ class cgxEasyAPI:
                 log.error(err)
                 if self.debug:
                     jd_detailed(res)
+                # the controller copy may have changed, read it again on next use
+                self.snmpagents.pop(element['id'], None)
                 return False, err
+            self.cache_element_item(self.snmpagents, element['id'], None, res)
             return True, ""
         
         snmpagent = snmpagents[0]
@@ -540,6 +1249,11 @@ class cgxEasyAPI:
             # search if username already configured
             for user in snmpagent['v3_config']['users_access']:
                 if user['user_name'] == user_name:
+                    if user.get("engine_id") == engine_id and user.get("security_level") == security_level and \
+                        user.get("auth_type") == auth_type and user.get("auth_phrase") == auth_phrase and \
+                        user.get("enc_type") == enc_type and user.get("enc_phrase") == enc_phrase:
+                        log.info("--- Username found with the same settings")
+                        return True, UNCHANGED
                     log.info("--- Username found. Updating existing user")
                     user["engine_id"]= engine_id
                     user["security_level"]= security_level
@@ -568,28 +1282,51 @@ class cgxEasyAPI:
             log.error(err)
             if self.debug:
                 jd_detailed(res)
+            # the controller copy may have changed, read it again on next use
+            self.snmpagents.pop(element['id'], None)
             return False, err
+        self.cache_element_item(self.snmpagents, element['id'], snmpagent['id'], res)
 
         return True, ""
-    def net_policy_add_global_prefix(self, prefix_name, prefixes, description=None, tags=[]):
+    @metrics.timed
+    @tracing.traced
+    def net_policy_add_global_prefix(self, prefix_name, prefixes, description=None, tags=[], aggregate=False):
         """ add prefixes to network policy global prefixlist
         :param prefix_name: The name of the prefix filter to add prefixes to, or to create if doesn't exists
         :type prefix_name: str
         :param prefixes: Prefixes in the form of ip/net_len. Example "10.2.3.0/8" or "13.6.8.5/32"
         :type prefixes: list
-        :return: Success, ErrMSG
+        :param aggregate: collapse overlapping and adjacent prefixes
+        :type aggregate: bool
+        :return: Success, ErrMSG. On success the message has the number of prefixes added and removed, or "unchanged"
         :rtype Success: Boolean
         :rtype ErrMSG: String
         """
         # shortcut
         sdk = self.sdk
 
+        # check if prefixes are valid
+        new_prefixes, err = normalize_prefixes(prefixes, aggregate=aggregate)
+        if new_prefixes is None:
+            return False, err
+
         # get a list of existing prefixlists. Maybe its alread exists
-        for prefix in sdk.get.networkpolicyglobalprefixes().cgx_content['items']:
+        res = sdk.get.networkpolicyglobalprefixes()
+        if not res:
+            err = f"--- Failed to get global prefixlists: {sdk.pull_content_error(res)}"
+            log.error(err)
+            if self.debug:
+                jd_detailed(res)
+            return False, err
+        for prefix in res.cgx_content['items']:
             if prefix['name'] == prefix_name:
                 # prefix found, add prefixes to the list
-                prefixes.extend(prefix['ipv4_prefixes'])
-                prefix['ipv4_prefixes'] = list(set(prefixes))
+                merged, added, removed, err = merge_prefixes(prefix['ipv4_prefixes'], new_prefixes, aggregate=aggregate)
+                if merged is None:
+                    return False, err
+                if not added and not removed:
+                    return True, UNCHANGED
+                prefix['ipv4_prefixes'] = merged
                 res = sdk.put.networkpolicyglobalprefixes(prefix['id'], prefix)
                 if not res:
                     err = f"--- Failed to update global prefixlist: {sdk.pull_content_error(res)}"
@@ -603,7 +1340,7 @@ class cgxEasyAPI:
             prefix = {
                 "name":prefix_name,
                 "tags":tags,
-                "ipv4_prefixes":prefixes,
+                "ipv4_prefixes":new_prefixes,
                 "description": description
             }
             res = sdk.post.networkpolicyglobalprefixes(prefix)
@@ -613,7 +1350,10 @@ class cgxEasyAPI:
                     log.error(err)
                     jd_detailed(res)
                 return False, err
-        return True, ""
+            added, removed = len(new_prefixes), 0
+        return True, f"added {added}, removed {removed}"
+    @metrics.timed
+    @tracing.traced
     def interface_add_subinterface(self, element_name, parent_interface_name, vlan, IP_Address, scope, description="", native_vlan=False, used_for="lan", type="static"):
         """Add sub interface
         :param element_name: The name of the ION device
@@ -641,19 +1381,24 @@ class cgxEasyAPI:
         element = db.fetch("name2element", element_name)
         if not element:
             return False, "Can't find element"
-        interfaces = self.get_interfaces(element['site_id'], element['id'])
 
         # find interface name 
-        for interface in interfaces:
-            if interface['name'] == parent_interface_name:
-                break
-        else:
-            return False, "Can't find interface"
+        interface, err = self.get_interface(element['site_id'], element['id'], name=parent_interface_name)
+        if not interface:
+            return False, err or "Can't find interface"
         
-        # check if sub interface exists
-        for sub_interface in interfaces:
-            if sub_interface['name'] == f"{parent_interface_name}.{vlan}":
-                return False, "Sub interface already exists"
+        # check if sub interface exists. Nothing to do if it has the same settings
+        sub_interface, err = self.get_interface(element['site_id'], element['id'], parent_id=interface['id'], vlan=vlan)
+        if not sub_interface:
+            sub_interface, err = self.get_interface(element['site_id'], element['id'], name=f"{parent_interface_name}.{vlan}")
+        if sub_interface:
+            ipv4_config = sub_interface.get('ipv4_config') or {}
+            if sub_interface.get('scope') == scope and sub_interface.get('used_for') == used_for and \
+                (sub_interface.get('description') or "") == description and ipv4_config.get('type') == type and \
+                (type != "static" or (ipv4_config.get('static_config') or {}).get('address') == IP_Address):
+                log.info(f"--- Sub interface {sub_interface['name']} already exists")
+                return True, UNCHANGED
+            return False, "Sub interface already exists with different settings"
 
         # create the sub interface
         new_interface = {
@@ -673,9 +1418,9 @@ class cgxEasyAPI:
         }
 
         if type == "static":
-            new_interface["ipv4_config"]={"dhcp_config":None,"dns_v4_config":None,"routes":None,"static_config":{"address":IP_Address},"type":"static"},
+            new_interface["ipv4_config"]={"dhcp_config":None,"dns_v4_config":None,"routes":None,"static_config":{"address":IP_Address},"type":"static"}
         else:
-            new_interface["ipv4_config"]={"dhcp_config":None,"dns_v4_config":None,"routes":None,"static_config":None,"type":"dhcp"},
+            new_interface["ipv4_config"]={"dhcp_config":None,"dns_v4_config":None,"routes":None,"static_config":None,"type":"dhcp"}
 
         
         res = sdk.post.interfaces(element['site_id'], element['id'], new_interface)
@@ -684,13 +1429,17 @@ class cgxEasyAPI:
             if self.debug:
                 log.error(err)
                 jd_detailed(res)
+            # the sub interface may exist already on the controller
+            self.drop_interfaces(element['id'])
             return False, err
 
-        # refresh interfaces for the elemnt as we changed an attribute
-        self.build_interfaces_cache(element['site_id'], element['id'])
+        # write the new interface through to the cache
+        self.cache_interface(element['site_id'], element['id'], res)
 
         return True, ""
-    def sec_policy_add_local_prefix(self, prefix_name, site_name, prefixes, description=None, tags=[]):
+    @metrics.timed
+    @tracing.traced
+    def sec_policy_add_local_prefix(self, prefix_name, site_name, prefixes, description=None, tags=[], aggregate=False):
         """ add prefixes to security policy local prefixlist
         :param prefix_name: The name of the prefix filter to add prefixes to, or to create if doesn't exists
         :type prefix_name: str
@@ -698,83 +1447,210 @@ class cgxEasyAPI:
         :type prefix_name: str
         :param prefixes: Prefixes in the form of ip/net_len. Example "10.2.3.0/8" or "13.6.8.5/32"
         :type prefixes: list
-        :return: Success, ErrMSG
+        :param aggregate: collapse overlapping and adjacent prefixes
+        :type aggregate: bool
+        :return: Success, ErrMSG. On success the message has the number of prefixes added and removed, or "unchanged"
         :rtype Success: Boolean
         :rtype ErrMSG: String
         """
-        # shortcut
-        sdk = self.sdk
-
         # check if tags is a list
         if not type(tags) is list:
             return False, "tag paramter should be a list of strings"
 
         # check if prefixes are valid
-        for prefix in prefixes:
-            try:
-                ipcalc.IP(prefix)
-            except ValueError:
-                return False,f"{prefix} is not a valid"
+        new_prefixes, err = normalize_prefixes(prefixes, aggregate=aggregate)
+        if new_prefixes is None:
+            return False, err
 
         # get site info
         site = db.fetch("name2site", site_name)
         if not site:
             return False, "Site not found"
 
-        # get a list of existing prefixlists. Maybe its alread exists
-        for prefix in sdk.get.ngfwsecuritypolicylocalprefixes().cgx_content['items']:
-            if prefix['name'] == prefix_name:
-                # prefix found, add prefixes to the list
-                break
-        else:
-            # prefix not found, we need to create a new one
-            prefix = {
-                "name":prefix_name,
-                "tags":tags,
-                "description": description
-            }
-            res = sdk.post.ngfwsecuritypolicylocalprefixes(prefix)
+        # get the prefix list, create it if doesn't exist
+        prefix_ids, err = self._sec_policy_local_prefix_ids([prefix_name], description, tags)
+        if prefix_ids is None:
+            return False, err
+
+        res, added, removed, err = self._sec_policy_site_update(site, {prefix_ids[prefix_name]: new_prefixes}, tags, aggregate)
+        if not res:
+            return False, err
+        if not added and not removed:
+            return True, UNCHANGED
+        return True, f"added {added}, removed {removed}"
+
+    @metrics.timed
+    @tracing.traced
+    def sec_policy_import_local_prefixes(self, file_name, description=None, tags=[], aggregate=False, max_workers=8):
+        """ add prefixes to security policy local prefixlists of many sites from a file.
+        The file is read as a stream. CSV files need a header with prefix_name, site and prefix columns,
+        .jsonl files have one {"prefix_name": .., "site": .., "prefix": ..} object per line.
+        Prefix lists are resolved once and each site is updated once, sites are updated in parallel.
+        :param file_name: CSV or JSONL file
+        :type file_name: str
+        :param description: description of prefix lists that need to be created
+        :type description: str
+        :param tags: tags of prefix lists that need to be created
+        :type tags: list
+        :param aggregate: collapse overlapping and adjacent prefixes
+        :type aggregate: bool
+        :param max_workers: number of sites updated in parallel
+        :type max_workers: int
+        :return: Success, ErrMSG. On success the message has a summary
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
+        """
+        # group prefixes by site and prefix list
+        sites = {}
+        prefix_names = set()
+        try:
+            for line_no, row in read_prefix_rows(file_name):
+                site = db.fetch("name2site", row['site'])
+                if not site:
+                    return False, f"{file_name} line {line_no}: Site {row['site']} not found"
+                sites.setdefault(site['id'], (site, {}))[1].setdefault(row['prefix_name'], []).append(row['prefix'])
+                prefix_names.add(row['prefix_name'])
+        except (OSError, ValueError, KeyError) as e:
+            return False, f"Can't read {file_name}: {e}"
+
+        # get the prefix lists, create the ones that don't exist
+        prefix_ids, err = self._sec_policy_local_prefix_ids(prefix_names, description, tags)
+        if prefix_ids is None:
+            return False, err
+
+        def update_site(site_id):
+            site, site_prefixes = sites[site_id]
+            prefixes_by_id = {}
+            for prefix_name, prefixes in site_prefixes.items():
+                new_prefixes, err = normalize_prefixes(prefixes, aggregate=aggregate)
+                if new_prefixes is None:
+                    return False, 0, 0, f"{site['name']}: {err}"
+                prefixes_by_id[prefix_ids[prefix_name]] = new_prefixes
+            return self._sec_policy_site_update(site, prefixes_by_id, tags, aggregate)
+
+        added = removed = unchanged = 0
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for res, site_added, site_removed, err in executor.map(tracing.bind(update_site), sites):
+                added += site_added
+                removed += site_removed
+                unchanged += bool(res and not site_added and not site_removed)
+                if not res:
+                    errors.append(err)
+
+        summary = f"sites {len(sites)}, unchanged {unchanged}, added {added}, removed {removed}, failed {len(errors)}"
+        log.info(f"--- Local prefix import: {summary}")
+        if errors:
+            return False, f"{summary}: {'; '.join(errors)}"
+        return True, summary
+
+    def _sec_policy_local_prefix_ids(self, prefix_names, description=None, tags=[]):
+        """ get the IDs of security policy local prefixlists, create the ones that don't exist
+        :param prefix_names: prefix list names
+        :type prefix_names: iterable
+        :return: dictionary of name to ID or None, ErrMSG
+        :rtype: dict, str
+        """
+        # shortcut
+        sdk = self.sdk
+
+        # parallel calls must not create the same prefixlist twice
+        with self.prefix_lock:
+            # get a list of existing prefixlists. Maybe its alread exists
+            res = sdk.get.ngfwsecuritypolicylocalprefixes()
             if not res:
-                err = f"--- Failed to local security prefixlist: {sdk.pull_content_error(res)}"
+                err = f"--- Failed to get local security prefixlists: {sdk.pull_content_error(res)}"
+                log.error(err)
                 if self.debug:
-                    log.error(err)
                     jd_detailed(res)
-                return False, err
-            prefix = res.cgx_content
+                return None, err
+            prefix_ids = {
+                prefix['name']: prefix['id']
+                for prefix in res.cgx_content['items']
+            }
+            for prefix_name in prefix_names:
+                if prefix_name in prefix_ids:
+                    continue
+                # prefix not found, we need to create a new one
+                prefix = {
+                    "name":prefix_name,
+                    "tags":tags,
+                    "description": description
+                }
+                res = sdk.post.ngfwsecuritypolicylocalprefixes(prefix)
+                if not res:
+                    err = f"--- Failed to local security prefixlist: {sdk.pull_content_error(res)}"
+                    if self.debug:
+                        log.error(err)
+                        jd_detailed(res)
+                    return None, err
+                prefix_ids[prefix_name] = res.cgx_content['id']
+        return prefix_ids, ""
 
-        prefix_id = prefix['id']
+    def _sec_policy_site_update(self, site, prefixes_by_id, tags=[], aggregate=False):
+        """ merge prefixes into the local prefixlists of a site with one write per prefixlist that changed
+        :param site: site object
+        :type site: dict
+        :param prefixes_by_id: normalized prefixes to add for each prefix list ID
+        :type prefixes_by_id: dict
+        :return: Success, number of prefixes added, number of prefixes removed, ErrMSG
+        :rtype: Boolean, int, int, str
+        """
+        # shortcut
+        sdk = self.sdk
 
+        added = removed = 0
         # get a list of site local prefixes. Maybe it already exists
-        for site_prefix in sdk.get.site_ngfwsecuritypolicylocalprefixes(site['id']).cgx_content['items']:
-            if site_prefix['prefix_id'] == prefix_id:
+        res = sdk.get.site_ngfwsecuritypolicylocalprefixes(site['id'])
+        if not res:
+            err = f"--- Failed to get local security prefixlists of {site['name']}: {sdk.pull_content_error(res)}"
+            log.error(err)
+            if self.debug:
+                jd_detailed(res)
+            return False, added, removed, err
+        site_prefixes = {
+            site_prefix['prefix_id']: site_prefix
+            for site_prefix in res.cgx_content['items']
+        }
+        for prefix_id, new_prefixes in prefixes_by_id.items():
+            if prefix_id in site_prefixes:
                 # local prefix found, add prefixes to the list
-                prefixes.extend(site_prefix['ipv4_prefixes'])
-                site_prefix['ipv4_prefixes'] = list(set(prefixes))
+                site_prefix = site_prefixes[prefix_id]
+                merged, prefix_added, prefix_removed, err = merge_prefixes(site_prefix['ipv4_prefixes'], new_prefixes, aggregate=aggregate)
+                if merged is None:
+                    return False, added, removed, err
+                if not prefix_added and not prefix_removed:
+                    continue
+                site_prefix['ipv4_prefixes'] = merged
                 res = sdk.put.site_ngfwsecuritypolicylocalprefixes(site['id'], site_prefix['id'], site_prefix)
                 if not res:
                     err = f"--- Failed to update local security prefixlist: {sdk.pull_content_error(res)}"
                     if self.debug:
                         log.error(err)
                         jd_detailed(res)
-                    return False, err
-                break
-        else:
-            # local prefix not found, lets create one
-            local_prefix = {
-                    "ipv4_prefixes": prefixes,
-                    "prefix_id": prefix_id,
-                    "tags": tags
-                        
-                    }
-            res = sdk.post.site_ngfwsecuritypolicylocalprefixes(site['id'], local_prefix)
-            if not res:
-                err = f"--- Failed to create local security prefixlist: {sdk.pull_content_error(res)}"
-                if self.debug:
-                    log.error(err)
-                    jd_detailed(res)
-                return False, err
-        return True, ""
-    
+                    return False, added, removed, err
+            else:
+                # local prefix not found, lets create one
+                local_prefix = {
+                        "ipv4_prefixes": new_prefixes,
+                        "prefix_id": prefix_id,
+                        "tags": tags
+                            
+                        }
+                res = sdk.post.site_ngfwsecuritypolicylocalprefixes(site['id'], local_prefix)
+                if not res:
+                    err = f"--- Failed to create local security prefixlist: {sdk.pull_content_error(res)}"
+                    if self.debug:
+                        log.error(err)
+                        jd_detailed(res)
+                    return False, added, removed, err
+                prefix_added, prefix_removed = len(new_prefixes), 0
+            added += prefix_added
+            removed += prefix_removed
+        return True, added, removed, ""
+
+    @metrics.timed
+    @tracing.traced
     def secure_fabric_add_tunnels(self, site1_name, site2_name):
         """ create site to site tunnels across all avialble paths
         :param site1_name: Site name 1
@@ -785,48 +1661,140 @@ class cgxEasyAPI:
         :rtype Success: Boolean
         :rtype ErrMSG: String
         """
+        return self.secure_fabric_build([site1_name, site2_name])
+
+    @metrics.timed
+    @tracing.traced
+    def secure_fabric_build(self, site_names, hub_names=None, max_workers=8):
+        """ create site to site tunnels across all avialble paths for a set of sites.
+        WAN interfaces and existing links are fetched once, only missing links are created.
+        :param site_names: Sites to connect. Full mesh if hub_names is not set, otherwise the spokes
+        :type site_names: list
+        :param hub_names: Hub sites. Each hub is connected to each spoke
+        :type hub_names: list
+        :param max_workers: number of links created in parallel
+        :type max_workers: int
+        :return: Success, summary of created/skipped/failed links
+        :rtype Success: Boolean
+        :rtype ErrMSG: String
+        """
         # shortcut
         sdk = self.sdk
 
-        # get siter1 info
-        site1 = db.fetch("name2site", site1_name)
-        if not site1:
-            return False, "Site1 not found"
-        # get siter2 info
-        site2 = db.fetch("name2site", site2_name)
-        if not site1:
-            return False, "Site1 not found"
-        
-        # get circuit labels for both sites
-        site1_waninterfaces = sdk.get.waninterfaces(site1['id']).cgx_content['items']
-        site2_waninterfaces = sdk.get.waninterfaces(site2['id']).cgx_content['items']
+        # get sites info
+        sites = {}
+        for site_name in list(site_names) + list(hub_names or []):
+            site = db.fetch("name2site", site_name)
+            if not site:
+                return False, f"Site {site_name} not found"
+            sites[site['id']] = site
+
+        # site pairs to connect
+        if hub_names:
+            hubs = [db.fetch("name2site", name)['id'] for name in hub_names]
+            spokes = [site_id for site_id in (db.fetch("name2site", name)['id'] for name in site_names) if site_id not in hubs]
+            pairs = [(hub, spoke) for hub in hubs for spoke in spokes]
+        else:
+            pairs = list(itertools.combinations(sites, 2))
+
+        # get circuit labels for all sites
+        def get_waninterfaces(site_id):
+            res = sdk.get.waninterfaces(site_id)
+            return site_id, res.cgx_content['items'] if res else None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            waninterfaces = dict(executor.map(tracing.bind(get_waninterfaces), sites))
+        for site_id, site_waninterfaces in waninterfaces.items():
+            if site_waninterfaces is None:
+                return False, f"Can't get WAN interfaces of {sites[site_id]['name']}"
+
+        # existing links between the sites
+        existing = self._get_anynetlinks(list(sites))
+
+        # compute the missing links
+        links = []
+        skipped = 0
+        for site1_id, site2_id in pairs:
+            for s1_waninterface in waninterfaces[site1_id]:
+                for s2_waninterface in waninterfaces[site2_id]:
+                    # skip if trying to bring up private to public
+                    if s1_waninterface['type'] != s2_waninterface['type']:
+                        continue
+                    if frozenset((s1_waninterface['id'], s2_waninterface['id'])) in existing:
+                        skipped += 1
+                        continue
+                    links.append((site1_id, s1_waninterface, site2_id, s2_waninterface))
 
         # create anynet links
-        for s1_waninterface in site1_waninterfaces:
-            for s2_waninterface in site2_waninterfaces:
-                # skip if trying to bring up private to public
-                if s1_waninterface['type'] != s2_waninterface['type']:
-                    continue
-                data = {
-                        "name":None, "description":None, "tags":None,
-                        "ep1_site_id":site1['id'],"ep1_wan_if_id":s1_waninterface['id'],
-                        "ep2_site_id":site2['id'],"ep2_wan_if_id":s2_waninterface['id'],
-                        "admin_up":True,"forced":True,"type":None,"vpnlink_configuration":None}
-                res = sdk.post.tenant_anynetlinks(data)
-                if not res:
-                    if res.status_code == 400:
-                        # link alraedy there
-                        if 'DUP_ANYNET' in res.text:
-                            if self.debug:
-                                log.info(f"VPN between {site1_name} {s1_waninterface['name']} and {site2_name} {s2_waninterface['name']} already exists. Continuing")
-                            continue
-                        else:
-                            pp(res.json())
-                            pp(s1_waninterface)
-                            pp(s2_waninterface)
-                        
+        def create_link(link):
+            site1_id, s1_waninterface, site2_id, s2_waninterface = link
+            name = f"{sites[site1_id]['name']} {s1_waninterface['name']} and {sites[site2_id]['name']} {s2_waninterface['name']}"
+            data = {
+                    "name":None, "description":None, "tags":None,
+                    "ep1_site_id":site1_id,"ep1_wan_if_id":s1_waninterface['id'],
+                    "ep2_site_id":site2_id,"ep2_wan_if_id":s2_waninterface['id'],
+                    "admin_up":True,"forced":True,"type":None,"vpnlink_configuration":None}
+            res = sdk.post.tenant_anynetlinks(data)
+            if res:
+                return "created", name
+            # link alraedy there
+            if res.status_code == 400 and 'DUP_ANYNET' in res.text:
+                if self.debug:
+                    log.info(f"VPN between {name} already exists. Continuing")
+                return "skipped", name
+            err = f"--- Can't create VPN between {name}: {sdk.pull_content_error(res)}"
+            log.error(err)
+            if self.debug:
+                jd_detailed(res)
+            return "failed", name
 
-        return True, ""
+        created = 0
+        failed = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for status, name in executor.map(tracing.bind(create_link), links):
+                if status == "created":
+                    created += 1
+                elif status == "skipped":
+                    skipped += 1
+                else:
+                    failed.append(name)
+
+        summary = f"created {created}, skipped {skipped}, failed {len(failed)}"
+        log.info(f"--- Secure fabric: {summary}")
+        if failed:
+            return False, f"{summary}: {', '.join(failed)}"
+        return True, summary
+
+    def _get_anynetlinks(self, site_ids):
+        """ get the existing links between sites. Links are queried in chunks of sites, a chunk
+        whose result was truncated is split in two and queried again
+        :param site_ids: site IDs
+        :type site_ids: list
+        :return: set of frozenset((ep1_wan_if_id, ep2_wan_if_id)). Links that can't be queried are missing
+        :rtype: set
+        """
+        existing = set()
+        chunks = [site_ids[i:i+ANYNETLINKS_QUERY_CHUNK] for i in range(0, len(site_ids), ANYNETLINKS_QUERY_CHUNK)]
+        while chunks:
+            chunk = chunks.pop()
+            data = {
+                "limit": ANYNETLINKS_QUERY_LIMIT,
+                "query_params": {"ep1_site_id": {"in": chunk}}
+            }
+            res = self.sdk.post.anynetlinks_query(data)
+            if not res:
+                log.warning(f"--- Can't query existing links of {len(chunk)} sites, relying on duplicate errors")
+                continue
+            items = res.cgx_content.get("items") or []
+            if len(items) < res.cgx_content.get("total_count", len(items)):
+                if len(chunk) > 1:
+                    chunks.extend([chunk[:len(chunk)//2], chunk[len(chunk)//2:]])
+                    continue
+                log.warning(f"--- Existing links query of site {chunk[0]} was truncated, relying on duplicate errors")
+            existing.update(
+                frozenset((item.get('ep1_wan_if_id'), item.get('ep2_wan_if_id')))
+                for item in items
+            )
+        return existing
 
 if __name__ == "__main__":
     # init logging
@@ -837,18 +1805,17 @@ if __name__ == "__main__":
     logging.getLogger("cgxEasyAPI").setLevel(logging.INFO)
     log = logging.getLogger("TEST")
 
-    #delete dhcp 
-    easy = cgxEasyAPI(cloudgenix_settings.CLOUDGENIX_AUTH_TOKEN, debug=1)
-    res, err = False, "Test"
-    #res, err= easy.interface_dhcprelay_add("Dan 2k", "3", "10.2.3.4", source_interface_name = "2")
-    #res, err = easy.dhcp_pool_add_option("Dan Home", "1.2.3.0/24", "", "option my_44 code 44 = text", 'option my_44 "as"')
-    #res, err = easy.dhcp_pool_del_option("Dan Home", "1.2.3.0/24", "my_44")
-    #res, err = easy.set_snmpv3_agent("Dan 2k", "dantest", "auth", "12423423423422", "kokoloko", "sha", None, "none")
-    #res, err = easy.set_snmpv3_agent("Dan 2k", "dantest", "auth", "12423423423422", "kokoroko", "sha", None, "none")
-    #res, err = easy.set_snmpv3_agent("Ansh-Hub", "uSNMP", "auth", "12423423423422", "kokoroko", "sha", None, "none")
-    #res,err = easy.sec_policy_add_local_prefix("easy2", "Dan Home",['172.16.0.0/12', '192.168.0.0/16', '10.0.0.0/8'])
-    #print(res, err)
-    #res,err = easy.sec_policy_add_local_prefix("easy2","Dan Home",['172.16.0.0/12'])
-    #print(res, err)
-    res,err = easy.secure_fabric_add_tunnels("PanDan - Branch", "1Dmitry-Branch-Rancho")
-    print(res,err)
+    # try the API against a local mock controller, never a real one
+    import mock_controller
+    controller = mock_controller.MockController()
+    controller.populate(4)
+    easy = cgxEasyAPI(mock_controller.AUTH_TOKEN, debug=1, controller=controller.start(), update_check=False)
+    res, err = easy.interface_tag_add("element-0", "1", "easy")
+    print(res, err)
+    res, err = easy.interface_dhcprelay_add("element-0", "1", "10.2.3.4", source_interface_name="2")
+    print(res, err)
+    res, err = easy.set_interface_zone("element-1", "1", "LAN")
+    print(res, err)
+    res, err = easy.secure_fabric_add_tunnels("site-0", "site-1")
+    print(res, err)
+    controller.stop()
@@ -1,21 +1,100 @@
 #!/usr/bin/env python3
-import cloudgenix
-from cloudgenix import jd, jd_detailed
+import time
+# time to prompt is measured from here
+START_TIME = time.perf_counter()
 import cloudgenix_settings
 from pprint import pprint as pp
 import sys
 import cmd
-import cgxEasyAPI
 import logging
 import re
+import argparse
+import threading
+import importlib.util
 import db
+import ratelimit
+import concurrency
+import metrics
+import tracing
+from concurrent.futures import ThreadPoolExecutor
+
+def lazy_import(name):
+    """ import a module on first attribute access
+    :param name: module name
+    :type name: str
+    :return: the module
+    """
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+# cgxEasyAPI imports the cloudgenix SDK and requests, only needed once an API command runs
+cgxEasyAPI = lazy_import("cgxEasyAPI")
+
+class LazyAPI:
+    """ stands in for the cgxEasyAPI object, logging in on first use
+    """
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: cgxEasyAPI arguments
+        """
+        self.kwargs = kwargs
+        self.api = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """ log in, once
+        :return: cgxEasyAPI object
+        :rtype: cgxEasyAPI.cgxEasyAPI
+        """
+        if self.api is None:
+            with self.lock:
+                if self.api is None:
+                    start = time.perf_counter()
+                    self.api = cgxEasyAPI.cgxEasyAPI(**self.kwargs)
+                    log.info(f"--- Logged in in {time.perf_counter() - start:.2f}s")
+        return self.api
+
+    def __getattr__(self, name):
+        return getattr(self.connect(), name)
+
+class LazySDK:
+    """ stands in for db.sdk until a table has to be fetched. db.sdk is set to the
+    real SDK when cgxapi logs in
+    """
+    def __getattr__(self, name):
+        return getattr(cgxapi.sdk, name)
 
 log = None
 cgxapi = None
+# adaptive limit of API calls in flight, None if disabled
+aimd = None
+# seconds from start to the first prompt
+startup_time = None
 class cgxcmd(cmd.Cmd):
-    SET_COMMANDS = ["interface_security_zone", "snmpv3_agent", ]
-    ADD_COMMANDS = ["dhcp_pool_option", "interface_tag", "interface_dhcp_relay"]
+    SET_COMMANDS = ["interface_security_zone", "snmpv3_agent", "dhcp_pool_options"]
+    ADD_COMMANDS = ["dhcp_pool_option", "interface_tag", "interface_dhcp_relay", "local_prefixes"]
     DELETE_COMMANDS = ['dhcp_pool_option', "dhcp_pool"]
+    # cgxEasyAPI methods that need the element interfaces. Interfaces are prefetched for bulk commands
+    INTERFACE_METHODS = ["interface_dhcprelay_add", "interface_tag_add", "set_interface_zone", "interface_update"]
+    # batch operations merged into one cgxEasyAPI.interface_update per interface: method -> edit
+    INTERFACE_EDITS = {"interface_tag_add": "tag", "interface_dhcprelay_add": "dhcp_relay"}
+    # number of elements worked on in parallel by bulk commands
+    max_workers = getattr(cloudgenix_settings, "CGXCMD_WORKERS", 8)
+    # element commands, typed at the prompt or read from batch files: pattern, cgxEasyAPI method. The first two groups select the elements
+    ELEMENT_SELECTOR = r'(element|element_file) \"([^\"]+)\"'
+    ELEMENT_COMMANDS = [
+        (re.compile(rf'^add interface_dhcp_relay {ELEMENT_SELECTOR} interface \"([^\"]+)\" server_ip \"([^\"]+)\"$'), "interface_dhcprelay_add"),
+        (re.compile(rf'^add interface_dhcp_relay {ELEMENT_SELECTOR} interface \"([^\"]+)\" server_ip \"([^\"]+)\" source_interface \"([^\"]+)\"$'), "interface_dhcprelay_add"),
+        (re.compile(rf'^add interface_tag {ELEMENT_SELECTOR} interface \"([^\"]+)\" tag \"([^\"]+)\"$'), "interface_tag_add"),
+        (re.compile(rf'^set interface_security_zone {ELEMENT_SELECTOR} interface \"([^\"]+)\" zone \"([^\"]+)\"$'), "set_interface_zone"),
+        (re.compile(rf'^set snmpv3_agent {ELEMENT_SELECTOR} user_name \"([^\"]+)\" security_level \"([^\"]+)\" engine_id \"([^\"]*)\" auth_phrase \"([^\"]*)\" auth_type \"([^\"]*)\" enc_phrase \"([^\"]*)\" enc_type \"([^\"]*)\"$'), "set_snmpv3_agent"),
+    ]
+    # errors listed before a batch is abandoned
+    BATCH_MAX_ERRORS = 20
 
     def clean_input(self, line):
         """ Clean any leading traling spaces. Also conver \" to ♞ to be later replaced by "
@@ -44,10 +123,401 @@ class cgxcmd(cmd.Cmd):
         except PermissionError:
             return False, f"No permission to read {file_name}"
 
+    def read_dhcp_options_file(self, file_name):
+        """Read DHCP option operations from a file. One operation per line:
+        add "<vci>" "<opt def>" "<opt value>"
+        replace "<vci>" "<opt def>" "<opt value>"
+        remove "<opt def name>"
+        :return: list of operations or False, ErrMSG
+        """
+        lines, err = self.read_file(file_name)
+        if lines == False:
+            return False, err
+        operations = []
+        for line_no, line in enumerate(lines, 1):
+            clean_line = self.clean_input(line)
+            if not clean_line or clean_line.startswith("#"):
+                continue
+            m = re.search(r'^(add|replace) \"([^\"]*)\" \"([^\"]+)\" \"([^\"]+)\"$', clean_line)
+            if m:
+                operations.append((m.group(1), *self.replace_knight(*m.groups()[1:])))
+                continue
+            m = re.search(r'^remove \"([^\"]+)\"$', clean_line)
+            if m:
+                operations.append(("remove", *self.replace_knight(*m.groups())))
+                continue
+            return False, f"{file_name} line {line_no}: can't parse {line.strip()}"
+        return operations, None
+
+    def get_element_names(self, element_re=None, element_file=None):
+        """Return a list of element names matching a regular expression or listed in a file
+        :return: element names, ErrMSG
+        """
+        if element_file:
+            lines, err = self.read_file(element_file)
+            if lines == False:
+                return False, err
+            return [line.strip() for line in lines if line.strip()], None
+        return [element['name'] for element in db.get_re("name2element", element_re)], None
+
+    def run_on_elements(self, element_names, func, *args):
+        """Run func(element_name, *args) for every element using a bounded thread pool
+        Calls for the same element are executed in order by the same worker.
+        Print a summary table at the end.
+        :return: dictionary of element name to list of (Success, ErrMSG)
+        """
+        # group calls per element to keep per element ordering
+        calls = {}
+        for element_name in element_names:
+            calls[element_name] = calls.get(element_name, 0) + 1
+
+        # warm the interfaces cache for all elements at once
+        if func.__name__ in self.INTERFACE_METHODS and len(calls) > 1:
+            res, err = cgxapi.prefetch_interfaces(list(calls), max_workers=self.max_workers)
+            if not res:
+                log.warning(err)
+
+        def worker(element_name):
+            results = []
+            with tracing.span("element", element=element_name):
+                for _ in range(calls[element_name]):
+                    log.info(f"Working on element {element_name}")
+                    try:
+                        res, err = func(element_name, *args)
+                    except Exception as e:
+                        res, err = False, f"{type(e).__name__}: {e}"
+                    if not res:
+                        log.error(f"{element_name}: {err}")
+                    results.append((res, err))
+            return results
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = dict(zip(calls, executor.map(tracing.bind(worker), calls)))
+
+        self.print_summary(results)
+        if aimd:
+            log.info(f"Concurrency: {aimd.stats()}")
+        return results
+
+    def parse_batch_line(self, line):
+        """Parse an element command, read from a batch file or typed at the prompt
+        :return: (element selector, selector value, cgxEasyAPI method name, arguments) or None for blank and comment lines, ErrMSG
+        """
+        clean_line = self.clean_input(line)
+        if not clean_line or clean_line.startswith("#"):
+            return None, None
+        for pattern, method_name in self.ELEMENT_COMMANDS:
+            m = pattern.search(clean_line)
+            if m:
+                selector, value, *args = self.replace_knight(*m.groups())
+                return (selector, value, method_name, args), None
+        return False, f"can't parse {line.strip()}"
+
+    def run_element_command(self, line):
+        """Run an element command typed at the prompt on the selected elements
+        :param line: the command, starting with add or set
+        :return: True if line is an element command
+        """
+        operation, err = self.parse_batch_line(line)
+        if not operation:
+            return False
+        selector, value, method_name, args = operation
+        if selector == "element_file":
+            element_names, err = self.get_element_names(element_file=value)
+        else:
+            element_names, err = self.get_element_names(element_re=value)
+        if element_names == False:
+            log.error(err)
+            return True
+        self.run_on_elements(element_names, getattr(cgxapi, method_name), *args)
+        return True
+
+    def read_batch(self, file_name):
+        """Parse a batch file without calling the API. The file is read line by line
+        :return: list of (line number, element selector, selector value, method name, arguments) or False, ErrMSG
+        """
+        operations = []
+        errors = []
+        try:
+            with open(file_name) as f:
+                for line_no, line in enumerate(f, 1):
+                    operation, err = self.parse_batch_line(line)
+                    if operation:
+                        operations.append((line_no, *operation))
+                    elif operation == False:
+                        errors.append(f"{file_name} line {line_no}: {err}")
+                        if len(errors) >= self.BATCH_MAX_ERRORS:
+                            break
+        except FileNotFoundError:
+            return False, f"File {file_name} not found"
+        except PermissionError:
+            return False, f"No permission to read {file_name}"
+        if errors:
+            return False, "\n".join(errors)
+        return operations, None
+
+    def coalesce_interface_edits(self, element_calls):
+        """Merge the tag and DHCP relay operations on each interface of an element into a single
+        interface_update call, at the position of the first one. Other operations keep their order
+        :param element_calls: list of (method name, arguments)
+        :return: list of (method name, arguments, edits), edits is the list of merged edits, one per
+            operation, or None for an operation that was not merged
+        """
+        merged = []
+        edits = {}
+        for method_name, args in element_calls:
+            if method_name not in self.INTERFACE_EDITS:
+                merged.append((method_name, args, None))
+                continue
+            interface_name, *values = args
+            if interface_name not in edits:
+                edits[interface_name] = []
+                merged.append(("interface_update", [interface_name, edits[interface_name]], edits[interface_name]))
+            edits[interface_name].append((self.INTERFACE_EDITS[method_name], *values))
+        return merged
+
+    def run_batch(self, file_name):
+        """Run the element commands of a batch file. The whole file is parsed and the elements are
+        resolved before any change is made. Operations are grouped by element, the interfaces, zone
+        bindings and SNMP agents of every element are fetched once, then the elements are worked on
+        in parallel, each element's operations in file order. When an update merged from several
+        edits fails, the edits are applied one by one so each command gets its own result
+        :return: dictionary of element name to list of (Success, ErrMSG), or False, ErrMSG
+        """
+        operations, err = self.read_batch(file_name)
+        if operations == False:
+            return False, err
+
+        # resolve the element selectors, each distinct selector once
+        selected = {}
+        calls = {}
+        errors = []
+        for line_no, selector, value, method_name, args in operations:
+            if (selector, value) not in selected:
+                if selector == "element":
+                    element_names, err = self.get_element_names(element_re=value)
+                else:
+                    element_names, err = self.get_element_names(element_file=value)
+                selected[(selector, value)] = element_names
+                if element_names == False:
+                    errors.append(f"{file_name} line {line_no}: {err}")
+            if selected[(selector, value)] == False:
+                continue
+            if not selected[(selector, value)]:
+                errors.append(f"{file_name} line {line_no}: no element matches {value}")
+            for element_name in selected[(selector, value)]:
+                calls.setdefault(element_name, []).append((method_name, args))
+            if len(errors) >= self.BATCH_MAX_ERRORS:
+                break
+        if errors:
+            return False, "\n".join(errors)
+        operation_count = sum(len(element_calls) for element_calls in calls.values())
+        calls = {element_name: self.coalesce_interface_edits(element_calls) for element_name, element_calls in calls.items()}
+        log.info(f"{len(operations)} commands, {operation_count} operations on {len(calls)} elements, "
+                 f"{sum(len(element_calls) for element_calls in calls.values())} after merging interface edits")
+
+        # fetch what the operations read once for the whole batch
+        methods = {method_name for element_calls in calls.values() for method_name, args, edits in element_calls}
+        if methods & set(self.INTERFACE_METHODS):
+            res, err = cgxapi.prefetch_interfaces(list(calls), max_workers=self.max_workers)
+            if not res:
+                log.warning(err)
+        # zone bindings and SNMP agents are only cached for the batch
+        try:
+            if {"set_interface_zone", "set_snmpv3_agent"} & methods:
+                res, err = cgxapi.prefetch_element_config(
+                    list(calls),
+                    zone_bindings="set_interface_zone" in methods,
+                    snmpagents="set_snmpv3_agent" in methods,
+                    max_workers=self.max_workers
+                )
+                if not res:
+                    log.warning(err)
+
+            def call(element_name, method_name, args):
+                try:
+                    return getattr(cgxapi, method_name)(element_name, *args)
+                except Exception as e:
+                    return False, f"{type(e).__name__}: {e}"
+
+            def worker(element_name):
+                results = []
+                with tracing.span("element", element=element_name):
+                    for method_name, args, edits in calls[element_name]:
+                        res, err = call(element_name, method_name, args)
+                        if not res and edits and len(edits) > 1:
+                            # one bad edit fails the whole update, find it and apply the others
+                            log.info(f"{element_name}: interface {args[0]} update failed, applying its {len(edits)} edits one by one")
+                            operation_results = [call(element_name, method_name, [args[0], [edit]]) for edit in edits]
+                        else:
+                            # one result per batch operation
+                            operation_results = [(res, err)] * (len(edits) if edits else 1)
+                        for res, err in operation_results:
+                            if not res:
+                                log.error(f"{element_name}: {err}")
+                        results.extend(operation_results)
+                return results
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = dict(zip(calls, executor.map(tracing.bind(worker), calls)))
+        finally:
+            cgxapi.clear_element_config()
+
+        self.print_summary(results)
+        if aimd:
+            log.info(f"Concurrency: {aimd.stats()}")
+        return results, None
+
+    def do_batch(self, line):
+        """ Run the element commands of a file. The file is checked before any change is made
+        batch "<file name>"
+            file lines: add interface_dhcp_relay, add interface_tag, set interface_security_zone
+            and set snmpv3_agent commands, with element or element_file
+        """
+        m = re.search(r'^\"([^\"]+)\"$', " ".join(line.split()))
+        if not m:
+            return log.error("Usage: batch \"<file name>\"")
+        results, err = self.run_batch(m.group(1))
+        if results == False:
+            log.error(err)
+
+    def print_summary(self, results):
+        """Print a per element summary table
+        :param results: dictionary of element name to list of (Success, ErrMSG)
+        """
+        if not results:
+            print("No elements matched")
+            return
+        width = max(len("Element"), *(len(name) for name in results))
+        print(f"{'Element':<{width}}  Result     Message")
+        print(f"{'-' * width}  ---------  -------")
+        failed = unchanged = 0
+        for element_name, element_results in results.items():
+            for res, err in element_results:
+                if not res:
+                    failed += 1
+                    result = "FAILED"
+                elif err == cgxEasyAPI.UNCHANGED:
+                    unchanged += 1
+                    result = "UNCHANGED"
+                else:
+                    result = "OK"
+                print(f"{element_name:<{width}}  {result:<9}  {'' if err == cgxEasyAPI.UNCHANGED else err}")
+        print(f"{len(results)} elements, {unchanged} unchanged, {failed} failed")
+
+    def do_workers(self, line):
+        """ Show or set the number of elements worked on in parallel
+        workers
+        workers <number>
+        """
+        if line.strip():
+            try:
+                max_workers = int(line)
+            except ValueError:
+                return log.error("Number of workers must be an integer")
+            if max_workers < 1:
+                return log.error("Number of workers must be at least 1")
+            self.max_workers = max_workers
+            if aimd:
+                aimd.set_maximum(max_workers)
+        print(f"workers: {self.max_workers}")
+        if aimd:
+            print(f"API calls in flight limit: {aimd.limit}")
+
     def do_exit(self, line):
         return True
     def do_EOF(self, line):
         return True
+    def do_refresh(self, line):
+        """ Refresh the site and element tables from the controller
+        refresh
+        """
+        if not db.refresh():
+            return log.error("Can't refresh the site and element tables")
+        log.info(f"Loaded {len(db.db['name2site'])} sites and {len(db.db['name2element'])} elements")
+
+    def do_sync(self, line):
+        """ Update the site, element and zone tables with the changes made on the controller
+        sync
+        sync every <seconds>
+        sync stop
+        """
+        args = line.split()
+        if not args:
+            if not db.sync():
+                return log.error("Can't sync the site, element and zone tables")
+            return log.info(f"{len(db.db['name2site'])} sites and {len(db.db['name2element'])} elements")
+        if args == ["stop"]:
+            db.stop_sync()
+            return
+        if len(args) != 2 or args[0] != "every":
+            return log.error("Usage: sync | sync every <seconds> | sync stop")
+        try:
+            interval = float(args[1])
+        except ValueError:
+            return log.error("Sync interval must be a number of seconds")
+        db.sync_background(interval)
+
+    def preloop(self):
+        """ report the time to the first prompt
+        """
+        global startup_time
+        if startup_time is None:
+            startup_time = time.perf_counter() - START_TIME
+            metrics.register_gauge("cgxcmd_startup_seconds", lambda: startup_time)
+            log.info(f"Ready in {startup_time * 1000:.0f} ms")
+
+    def onecmd(self, line):
+        """ run every command in a trace span
+        """
+        with tracing.span("command", line=line.strip()):
+            return super().onecmd(line)
+
+    def do_trace(self, line):
+        """ Record nested spans of commands, elements, methods and API calls to a trace file.
+        Open the file with chrome://tracing or https://ui.perfetto.dev
+        trace start "<file name>"
+        trace stop
+        """
+        clean_line = " ".join(line.split())
+        m = re.search(r'start \"(.*)\"', clean_line)
+        if m:
+            tracing.start(m.group(1))
+            log.info(f"Tracing to {tracing.trace_file}")
+        elif clean_line == "stop":
+            res, err = tracing.stop()
+            if not res:
+                return log.error(err)
+            log.info(err)
+        else:
+            log.error("Usage: trace start \"<file name>\" or trace stop")
+
+    def do_stats(self, line):
+        """ Show or export API call metrics
+        stats
+        stats json "<file name>"
+        stats prometheus "<file name>"
+        stats reset
+        """
+        clean_line = " ".join(line.split())
+        if not clean_line:
+            print(metrics.to_table())
+            return
+        if clean_line == "reset":
+            metrics.reset()
+            return
+        m = re.search(r'(json|prometheus) \"(.*)\"', clean_line)
+        if not m:
+            return log.error("Usage: stats [json|prometheus \"<file name>\"|reset]")
+        export_format, file_name = m.groups()
+        text = metrics.to_json() if export_format == "json" else metrics.to_prometheus()
+        try:
+            with open(file_name, "w") as f:
+                f.write(text)
+        except OSError as e:
+            return log.error(f"Can't write {file_name}: {e}")
+        log.info(f"Metrics written to {file_name}")
+
     def do_show(self, line):
         """ Show stuff
         show elements "regualr expression"
@@ -71,60 +541,13 @@ class cgxcmd(cmd.Cmd):
         add dhcp_pool_option site "<site name>" subnet "<subnet with /mask>" opt_vci "<vendor class id, can be empty>" opt_def "<opt definition>" opt_val "<opt value>"
         add interface_tag element "<element name>" interface "<interface name>" tag "<tag>"
         add interface_tag element_file "<element file name>" interface "<interface name>" tag "<tag>"
+        add local_prefixes file "<csv file with prefix_name,site,prefix columns or .jsonl file>"
         """
 
+        if self.run_element_command(f"add {line}"):
+            return
         # clean any white spaces and turn \" to a knight
         clean_line = self.clean_input(line)
-        m = re.search(r'interface_dhcp_relay element \"([^\"]+)\" interface \"([^\"]+)\" server_ip \"([^\"]+)\"$', clean_line)
-        if m:
-            element_re, interface, server_ip = m.groups()
-            elements = db.get_re("name2element", element_re)
-            for element in elements:
-                log.info(f"Working on element {element['name']}")
-                res, err = cgxapi.interface_dhcprelay_add(element['name'], interface, server_ip)
-                if not res:
-                    log.error(err)
-            return
-
-        m = re.search(r'interface_dhcp_relay element \"([^\"]+)\" interface \"([^\"]+)\" server_ip \"([^\"]+)\" source_interface \"([^\"]+)\"$', clean_line)
-        if m:
-            element_re, interface, server_ip, source_interface = m.groups()
-            elements = db.get_re("name2element", element_re)
-            for element in elements:
-                log.info(f"Working on element {element['name']}")
-                res, err = cgxapi.interface_dhcprelay_add(element['name'], interface, server_ip, source_interface)
-                if not res:
-                    log.error(err)
-            return
-
-        m = re.search(r'interface_dhcp_relay element_file \"([^\"]+)\" interface \"([^\"]+)\" server_ip \"([^\"]+)\"$', clean_line)
-        if m:
-            element_file, interface, server_ip = m.groups()
-            elements, err = self.read_file(element_file)
-            if elements == False:
-                log.error(err)
-                return
-            for element in elements:
-                log.info(f"Working on element {element.strip()}")
-                res, err = cgxapi.interface_dhcprelay_add(element.strip(), interface, server_ip)
-                if not res:
-                    log.error(err)
-            return
-
-        m = re.search(r'interface_dhcp_relay element_file \"([^\"]+)\" interface \"([^\"]+)\" server_ip \"([^\"]+)\" source_interface \"([^\"]+)\"$', clean_line)
-        if m:
-            element_file, interface, server_ip, source_interface = m.groups()
-            elements, err = self.read_file(element_file)
-            if elements == False:
-                log.error(err)
-                return
-            for element in elements:
-                log.info(f"Working on element {element.strip()}")
-                res, err = cgxapi.interface_dhcprelay_add(element.strip(), interface, server_ip, source_interface)
-                if not res:
-                    log.error(err)
-            return
-
         m = re.search(r'dhcp_pool_option site \"([^\"]+)\" subnet \"([^\"]+)\" opt_vci \"([^\"]*)\" opt_def \"([^\"]+)\" opt_val \"([^\"]+)\"$', clean_line)
         if m:
             site, subnet, opt_vci, opt_def, opt_val = self.replace_knight(*m.groups())
@@ -133,29 +556,14 @@ class cgxcmd(cmd.Cmd):
                 log.error(err)
             return
 
-        m = re.search(r'interface_tag element \"([^\"]+)\" interface \"([^\"]+)\" tag \"([^\"]+)\"$', clean_line)
-        if m:
-            element_re, interface, tag = self.replace_knight(*m.groups())
-            elements = db.get_re("name2element", element_re)
-            for element in elements:
-                log.info(f"Working on element {element['name']}")
-                res, err = cgxapi.interface_tag_add(element['name'], interface, tag)
-                if not res:
-                    log.error(err)
-            return
-
-        m = re.search(r'interface_tag element_file \"([^\"]+)\" interface \"([^\"]+)\" tag \"([^\"]+)\"$', clean_line)
+        m = re.search(r'local_prefixes file \"([^\"]+)\"$', clean_line)
         if m:
-            element_file, interface, tag = self.replace_knight(*m.groups())
-            elements, err = self.read_file(element_file)
-            if elements == False:
+            file_name, = self.replace_knight(*m.groups())
+            res, err = cgxapi.sec_policy_import_local_prefixes(file_name, max_workers=self.max_workers)
+            if not res:
                 log.error(err)
-                return
-            for element in elements:
-                log.info(f"Working on element {element.strip()}")
-                res, err = cgxapi.interface_tag_add(element.strip(), interface, tag)
-                if not res:
-                    log.error(err)
+            else:
+                log.info(err)
             return
         return log.error("Command not found")
         
@@ -180,57 +588,25 @@ class cgxcmd(cmd.Cmd):
         set interface_security_zone element "<element_name>" interface "<interface_name>" zone "<zone_name>"
         set interface_security_zone element_file "<element_file_name>" interface "<interface_name>" zone "<zone_name>"
         set snmpv3_agent element "<element name>" user_name "<user name>" security_level "<security level>" engine_id  "<engine id>" auth_phrase "<auth phrase>" auth_type "<auth type>" enc_phrase "<encryption phrase>" enc_type "<encryption type>"
+        set dhcp_pool_options site "<site name>" subnet "<subnet/mask>[,<subnet/mask>...]" options_file "<options file name>"
+            options file lines: add "<vci>" "<opt def>" "<opt value>" | replace "<vci>" "<opt def>" "<opt value>" | remove "<opt def name>"
         """
         
+        if self.run_element_command(f"set {line}"):
+            return
         # remove spaces
         clean_line = " ".join(line.split())
 
-        m = re.search(r'interface_security_zone element \"(.*)\" interface \"(.*)\" zone \"(.*)\"', clean_line)
-        if m:
-            element_re, interface, zone = m.groups()
-            elements = db.get_re("name2element", element_re)
-            for element in elements:
-                log.info(f"Working on element {element['name']}")
-                res, err = cgxapi.set_interface_zone(element['name'], interface, zone)
-                if not res:
-                    log.error(err)
-            return
-        m = re.search(r'interface_security_zone element_file \"(.*)\" interface \"(.*)\" zone \"(.*)\"', clean_line)
+        m = re.search(r'dhcp_pool_options site \"([^\"]+)\" subnet \"([^\"]+)\" options_file \"([^\"]+)\"$', clean_line)
         if m:
-            element_file, interface, zone = m.groups()
-            elements, err = self.read_file(element_file)
-            if elements == False:
+            site_name, subnets, options_file = m.groups()
+            operations, err = self.read_dhcp_options_file(options_file)
+            if operations == False:
                 log.error(err)
                 return
-            for element in elements:
-                log.info(f"Working on element {element.strip()}")
-                res, err = cgxapi.set_interface_zone(element.strip(), interface, zone)
-                if not res:
-                    log.error(err)
-            return
-
-        m = re.search(r'snmpv3_agent element \"([^\"]+)\" user_name \"([^\"]+)\" security_level \"([^\"]+)\" engine_id \"([^\"]*)\" auth_phrase \"([^\"]*)\" auth_type \"([^\"]*)\" enc_phrase \"([^\"]*)\" enc_type \"([^\"]*)\"', clean_line)
-        if m:
-            element_re, user_name, security_level, engine_id, auth_phrase , auth_type, enc_phrase, enc_type= self.replace_knight(*m.groups())
-            elements = db.get_re("name2element", element_re)
-            for element in elements:
-                log.info(f"Working on element {element['name']}")
-                res, err = cgxapi.set_snmpv3_agent(element['name'], user_name, security_level, engine_id, auth_phrase , auth_type, enc_phrase, enc_type)
-                if not res:
-                    log.error(err)
-            return
-        m = re.search(r'snmpv3_agent element_file \"([^\"]+)\" user_name \"([^\"]+)\" security_level \"([^\"]+)\" engine_id \"([^\"]*)\" auth_phrase \"([^\"]*)\" auth_type \"([^\"]*)\" enc_phrase \"([^\"]*)\" enc_type \"([^\"]*)\"', clean_line)
-        if m:
-            element_file, user_name, security_level, engine_id, auth_phrase , auth_type, enc_phrase, enc_type= self.replace_knight(*m.groups())
-            elements, err = self.read_file(element_file)
-            if elements == False:
+            res, err = cgxapi.dhcp_pool_update_options(site_name, [subnet.strip() for subnet in subnets.split(",")], operations)
+            if not res:
                 log.error(err)
-                return
-            for element in elements:
-                log.info(f"Working on element {element.strip()}")
-                res, err = cgxapi.set_snmpv3_agent(element['name'], user_name, security_level, engine_id, auth_phrase , auth_type, enc_phrase, enc_type)
-                if not res:
-                    log.error(err)
             return
         return log.error("Command not found")
 
@@ -259,10 +635,67 @@ class cgxcmd(cmd.Cmd):
         return completions
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CloudGenix bulk configuration shell")
+    parser.add_argument("--batch", help="run the element commands of a file instead of the interactive shell")
+    parser.add_argument("--workers", type=int, help="elements worked on in parallel, default CGXCMD_WORKERS")
+    args = parser.parse_args()
+    if args.workers:
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
+        cgxcmd.max_workers = args.workers
+
     # init logging
+    logging.basicConfig(level=logging.INFO)
     log = logging.getLogger("cgxcmd")
 
     # init cgxEasyAPI
-    cgxapi = cgxEasyAPI.cgxEasyAPI(cloudgenix_settings.CLOUDGENIX_AUTH_TOKEN)
-    cgxcmd().cmdloop()
+    rate_limiter = ratelimit.RateLimiter(
+        read_rate=getattr(cloudgenix_settings, "CGX_READ_RATE", None),
+        write_rate=getattr(cloudgenix_settings, "CGX_WRITE_RATE", None),
+        shared_file=getattr(cloudgenix_settings, "CGX_RATE_LIMIT_FILE", None)
+    )
+    # adapt the number of API calls in flight, up to one per worker
+    aimd = None
+    if getattr(cloudgenix_settings, "CGX_ADAPTIVE_CONCURRENCY", True):
+        aimd = concurrency.AIMDLimiter(maximum=cgxcmd.max_workers)
+    # trace the whole session
+    trace_file = getattr(cloudgenix_settings, "CGX_TRACE_FILE", None)
+    if trace_file:
+        tracing.start(trace_file)
+    # record the session's API calls, or replay a recording without the network
+    recording = None
+    cassette_file = getattr(cloudgenix_settings, "CGX_CASSETTE_FILE", None)
+    if cassette_file:
+        import cassette
+        recording = cassette.Cassette(
+            cassette_file,
+            mode=getattr(cloudgenix_settings, "CGX_CASSETTE_MODE", "record"),
+            speed=getattr(cloudgenix_settings, "CGX_CASSETTE_SPEED", 0)
+        )
+    # log in on the first command that needs the API
+    cgxapi = LazyAPI(auth_token=cloudgenix_settings.CLOUDGENIX_AUTH_TOKEN, rate_limiter=rate_limiter, concurrency=aimd, cassette=recording)
+    # until then name lookups are answered from the snapshot
+    if not recording and db.load_cache() and db.cache_age() > db.CACHE_TTL:
+        log.info(f"Snapshot is {db.cache_age() / 60:.0f} minutes old, it will be synced on login")
+    db.sdk = LazySDK()
+    # keep the tables current in long sessions
+    sync_interval = getattr(cloudgenix_settings, "CGX_SYNC_INTERVAL", None)
+    if sync_interval:
+        db.sync_background(sync_interval)
+    exit_code = 0
+    if args.batch:
+        results, err = cgxcmd().run_batch(args.batch)
+        if results == False:
+            log.error(err)
+            exit_code = 2
+        elif any(not res for element_results in results.values() for res, err in element_results):
+            exit_code = 1
+    else:
+        cgxcmd().cmdloop()
+    if recording:
+        recording.close()
+    if tracing.enabled:
+        res, err = tracing.stop()
+        print(err)
+    sys.exit(exit_code)
 
@@ -0,0 +1,137 @@
+# adaptive limit of API calls in flight
+import time
+import threading
+import logging
+
+log = logging.getLogger("cgxEasyAPI.concurrency")
+
+# status codes that mean the controller is overloaded, counted in the window error rate
+OVERLOAD_STATUS = [429, 500, 502, 503, 504, 599]
+# status codes that shrink the limit right away
+THROTTLE_STATUS = [429]
+
+class AIMDLimiter:
+    """ limits the number of API calls in flight using additive increase / multiplicative decrease.
+    Every `window` completed calls the limit grows by `increase` if the p95 latency and the
+    error rate are healthy, and is multiplied by `decrease` otherwise. The error rate is the share
+    of overload statuses (429/5xx) in the window. A throttling status (429) shrinks the limit right
+    away, once per round of calls in flight.
+    """
+    def __init__(self, initial=4, minimum=1, maximum=32, increase=1, decrease=0.5, window=20,
+                 max_error_rate=0.05, latency_target=None, latency_factor=3):
+        """
+        :param initial: starting limit
+        :type initial: int
+        :param minimum: lowest limit
+        :type minimum: int
+        :param maximum: highest limit
+        :type maximum: int
+        :param increase: added to the limit after a healthy window
+        :type increase: int
+        :param decrease: limit multiplier on overload
+        :type decrease: float
+        :param window: number of calls per evaluation
+        :type window: int
+        :param max_error_rate: highest healthy rate of overload status codes in a window
+        :type max_error_rate: float
+        :param latency_target: highest healthy p95 latency in seconds. Default latency_factor times the best p95 seen
+        :type latency_target: float
+        :param latency_factor: see latency_target
+        :type latency_factor: float
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.max_error_rate = max_error_rate
+        self.latency_target = latency_target
+        self.latency_factor = latency_factor
+        self.baseline = None
+        self.in_flight = 0
+        self.samples = []
+        self.p95 = None
+        # calls completed since the limit was last decreased, and calls in flight at that time
+        self.since_decrease = 0
+        self.drain = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """ block until a call can be sent
+        :returns: seconds waited
+        :rtype: float
+        """
+        start = time.monotonic()
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+        return time.monotonic() - start
+
+    def release(self, latency, status_code):
+        """ report a completed call
+        :param latency: call duration in seconds
+        :type latency: float
+        :param status_code: HTTP status code
+        :type status_code: int
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.since_decrease += 1
+            # calls sent before the last decrease don't count
+            if self.since_decrease > self.drain:
+                self.samples.append((latency, status_code in OVERLOAD_STATUS))
+                if status_code in THROTTLE_STATUS:
+                    self._set_limit(self.limit * self.decrease, f"status {status_code}")
+                elif len(self.samples) >= self.window:
+                    self._evaluate()
+            self.condition.notify_all()
+
+    def set_maximum(self, maximum):
+        """ change the highest limit
+        :param maximum: highest limit
+        :type maximum: int
+        """
+        with self.condition:
+            self.maximum = maximum
+            self._set_limit(self.limit, None)
+            self.condition.notify_all()
+
+    def _evaluate(self):
+        """ adjust the limit from the window samples
+        """
+        latencies = sorted(latency for latency, _ in self.samples)
+        self.p95 = latencies[int(len(latencies) * 0.95) - 1]
+        error_rate = sum(overload for _, overload in self.samples) / len(self.samples)
+        self.baseline = self.p95 if self.baseline is None else min(self.baseline, self.p95)
+        latency_target = self.latency_target or self.baseline * self.latency_factor
+
+        if error_rate > self.max_error_rate:
+            self._set_limit(self.limit * self.decrease, f"error rate {error_rate:.0%}")
+        elif self.p95 > latency_target:
+            self._set_limit(self.limit * self.decrease, f"p95 latency {self.p95:.2f}s")
+        else:
+            self._set_limit(self.limit + self.increase, None)
+
+    def _set_limit(self, limit, reason):
+        """ change the limit and start a new window
+        """
+        limit = int(max(self.minimum, min(limit, self.maximum)))
+        if reason:
+            self.since_decrease = 0
+            self.drain = self.in_flight
+            if limit != self.limit:
+                log.info(f"Concurrency limit {self.limit} -> {limit} ({reason})")
+        elif limit != self.limit:
+            log.debug(f"Concurrency limit {self.limit} -> {limit}")
+        self.limit = limit
+        self.samples = []
+
+    def stats(self):
+        """ current state
+        :returns: limit, calls in flight and last p95 latency
+        :rtype: dict
+        """
+        with self.condition:
+            return {"limit": self.limit, "in_flight": self.in_flight, "p95": self.p95}
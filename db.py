@@ -1,14 +1,52 @@
 # object database
 import re
+import os
+import bisect
+import fnmatch
+import functools
+import json
+import gzip
+import time
+import threading
+import logging
+import metrics
+import tracing
+
+log = logging.getLogger("cgxEasyAPI.db")
 
 sdk = None
-def init(sdk_in):
+
+# on disk snapshot of the translation tables. Set CACHE_FILE to None to disable
+CACHE_FILE = os.path.expanduser("~/.cgxEasyAPI_cache.json.gz")
+# how long (seconds) a snapshot is considered fresh. Stale snapshots are still used
+# at startup but are refreshed in the background
+CACHE_TTL = 3600
+CACHE_VERSION = 1
+
+def init(sdk_in, cache_file=False, cache_ttl=None, refresh=False):
     """ initilize the module
     :param sdk_in: authenticated cloudgenix API object
     :type sdk_in: cloudgenix.API()
+    :param cache_file: snapshot file to use. None disables the snapshot, False keeps the default
+    :type cache_file: str
+    :param cache_ttl: seconds before the snapshot is refreshed in the background
+    :type cache_ttl: int
+    :param refresh: ignore the snapshot and fetch the tables from the controller on first use
+    :type refresh: bool
     """
-    global sdk 
+    global sdk, CACHE_FILE, CACHE_TTL
     sdk = sdk_in
+    if cache_file is not False:
+        CACHE_FILE = cache_file
+    if cache_ttl is not None:
+        CACHE_TTL = cache_ttl
+
+    if refresh:
+        clear()
+        return
+    if load_cache() and cache_age() > CACHE_TTL:
+        log.info("Snapshot is stale, syncing in the background")
+        sync_background()
 
 # init db sturcture
 db={}
@@ -16,17 +54,439 @@ db={}
 db['id2site'] = {}
 db['name2site'] = {}
 db['name2element'] = {}
+db['id2element'] = {}
+db['serial2element'] = {}
+db['site_id2elements'] = {}
+# security zones
+db['id2zone'] = {}
+db['name2zone'] = {}
+
+# the controller object list each table is built from
+TABLES = {
+    'id2site': 'sites',
+    'name2site': 'sites',
+    'name2element': 'elements',
+    'id2element': 'elements',
+    'serial2element': 'elements',
+    'site_id2elements': 'elements',
+    'id2zone': 'zones',
+    'name2zone': 'zones',
+}
+# seconds before a list is fetched again on next use. Lists not here never expire
+TTL = {
+    'zones': 3600,
+}
+# seconds before a list is fetched again for a key that is missing from it, see refetch
+REFETCH_AGE = 60
+# time each list was last fetched again by refetch
+refetch_time = {}
+
+# protects the tables while they are rebuilt
+lock = threading.RLock()
+# time the tables were last fetched from the controller
+db_time = {}
+
+# query endpoint of each list, used by sync
+QUERIES = {
+    'sites': 'site_query',
+    'elements': 'element_query',
+    'zones': 'securityzones_query',
+}
+SYNC_QUERY_LIMIT = 100000
+# set to stop the sync_background timer, see stop_sync. Each timer has its own event
+sync_stop = threading.Event()
+# thread of the sync_background timer
+sync_thread = None
+
+def _build_sites(sites):
+    """ build the site translation tables from a list of sites
+    """
+    id2site = {}
+    name2site = {}
+    for site in sites:
+        id2site[site['id']] = site
+        name2site[site['name']] = site
+    with lock:
+        db['id2site'] = id2site
+        db['name2site'] = name2site
+
+def _build_elements(elements):
+    """ build the element translation tables from a list of elements
+    """
+    name2element = {}
+    id2element = {}
+    serial2element = {}
+    site_id2elements = {}
+    for element in elements:
+        name2element[element['name']] = element
+        id2element[element['id']] = element
+        if element.get('serial_number'):
+            serial2element[element['serial_number']] = element
+        site_id2elements.setdefault(element.get('site_id'), []).append(element)
+    with lock:
+        db['name2element'] = name2element
+        db['id2element'] = id2element
+        db['serial2element'] = serial2element
+        db['site_id2elements'] = site_id2elements
 
+def _build_zones(zones):
+    """ build the security zone translation tables from a list of zones
+    """
+    id2zone = {}
+    name2zone = {}
+    for zone in zones:
+        id2zone[zone['id']] = zone
+        name2zone[zone['name']] = zone
+    with lock:
+        db['id2zone'] = id2zone
+        db['name2zone'] = name2zone
+
+def _items(kind):
+    """ the loaded objects of a list
+    :param kind: sites, elements or zones
+    :type kind: str
+    :rtype: list
+    """
+    if kind == 'sites':
+        return list(db['id2site'].values())
+    if kind == 'elements':
+        return list(db['id2element'].values())
+    return list(db['id2zone'].values())
+
+def _build(kind, items):
+    """ build the translation tables of a list
+    """
+    if kind == 'sites':
+        _build_sites(items)
+    elif kind == 'elements':
+        _build_elements(items)
+    else:
+        _build_zones(items)
+
+def _get_items(kind):
+    """ get a list of objects from the controller
+    :param kind: sites, elements or zones
+    :type kind: str
+    :returns: objects, None if the request failed
+    :rtype: list
+    """
+    if kind == 'sites':
+        res = sdk.get.sites()
+    elif kind == 'elements':
+        res = sdk.get.elements()
+    else:
+        res = sdk.get.securityzones()
+    if not res:
+        log.error(f"Can't get {kind}: {sdk.pull_content_error(res)}")
+        return None
+    return res.cgx_content['items']
+
+@metrics.timed
+@tracing.traced
 def init_db(db_name):
     """ initilize sites translation db
     """
-    if db_name in ['id2site', 'name2site']:
-        for site in sdk.get.sites().cgx_content['items']:
-            db['id2site'][site['id']] = site
-            db['name2site'][site['name']] = site
-    elif db_name in ['name2element']:
-        for element in sdk.get.elements().cgx_content['items']:
-            db['name2element'][element['name']] = element
+    kind = TABLES[db_name]
+    with lock:
+        items = _get_items(kind)
+        # leave the table as it is, it will be fetched again on next use
+        if items is None:
+            return
+        _build(kind, items)
+        db_time[kind] = time.time()
+        save_cache()
+
+def expired(db_name):
+    """ check if a table needs to be fetched
+    :param db_name: The database name
+    :type db_name: str
+    :returns: True if the table was never fetched or is older than its TTL
+    :rtype: bool
+    """
+    kind = TABLES[db_name]
+    if kind not in db_time:
+        return True
+    return kind in TTL and time.time() - db_time[kind] > TTL[kind]
+
+def _login():
+    """ touch the SDK before taking lock. An SDK that logs in on first use calls init, which takes
+    lock in the thread logging in, and would wait for a thread holding lock to wait for the login
+    """
+    getattr(sdk, "tenant_id", None)
+
+def _ensure(db_name):
+    """ build the table if it is missing or expired
+    """
+    if expired(db_name):
+        _login()
+        with lock:
+            if expired(db_name):
+                # a loaded table past its TTL only needs the changes
+                if TABLES[db_name] in db_time:
+                    sync([TABLES[db_name]])
+                else:
+                    init_db(db_name)
+
+def invalidate(db_name):
+    """ expire a table and the tables built from the same list. They will be fetched on next use.
+    The current tables stay readable until the new ones replace them
+    :param db_name: The database name, or the list name (sites, elements, zones)
+    :type db_name: str
+    """
+    kind = TABLES.get(db_name, db_name)
+    with lock:
+        db_time.pop(kind, None)
+
+def refetch(db_name, min_age=None):
+    """ fetch a table again because a key is missing from it, at most once every min_age seconds,
+    so repeated misses of the same unknown key don't fetch the list every time. The tables are
+    replaced as a whole, readers holding the old tables are not affected
+    :param db_name: The database name
+    :type db_name: str
+    :param min_age: seconds since the last fetch before fetching again. Default REFETCH_AGE
+    :type min_age: float
+    :returns: True if the table was fetched
+    :rtype: bool
+    """
+    kind = TABLES[db_name]
+    min_age = REFETCH_AGE if min_age is None else min_age
+    _login()
+    with lock:
+        last = max(db_time.get(kind, 0), refetch_time.get(kind, 0))
+        if time.time() - last < min_age:
+            return False
+        refetch_time[kind] = time.time()
+        init_db(db_name)
+        return True
+
+def get_table(db_name):
+    """ get a whole table
+    :param db_name: The database name
+    :type db_name: str
+    :returns: key to object dictionary
+    :rtype: dictionary
+    """
+    _ensure(db_name)
+    return db[db_name]
+
+def clear():
+    """ drop all tables. They will be fetched again on next use
+    """
+    with lock:
+        for db_name in db:
+            db[db_name] = {}
+        db_time.clear()
+
+def cache_age():
+    """ age in seconds of the oldest loaded table
+    :returns: age in seconds, 0 if nothing is loaded
+    :rtype: float
+    """
+    if not db_time:
+        return 0
+    return time.time() - min(db_time.values())
+
+def save_cache():
+    """ write the loaded tables to the snapshot file
+    """
+    if not CACHE_FILE:
+        return
+    with lock:
+        snapshot = {
+            "version": CACHE_VERSION,
+            "controller": getattr(sdk, "controller", None),
+            "tenant_id": getattr(sdk, "tenant_id", None),
+            "db_time": dict(db_time),
+            "sites": _items('sites') if 'sites' in db_time else None,
+            "elements": _items('elements') if 'elements' in db_time else None,
+            "zones": _items('zones') if 'zones' in db_time else None,
+        }
+    tmp_file = f"{CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with gzip.open(tmp_file, "wt") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(tmp_file, CACHE_FILE)
+    except OSError as e:
+        log.warning(f"Can't write snapshot {CACHE_FILE}: {e}")
+
+def load_cache():
+    """ load the tables from the snapshot file
+    :returns: True if a snapshot was loaded
+    :rtype: bool
+    """
+    if not CACHE_FILE:
+        return False
+    try:
+        with gzip.open(CACHE_FILE, "rt") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        log.warning(f"Ignoring unreadable snapshot {CACHE_FILE}: {e}")
+        return False
+
+    if snapshot.get("version") != CACHE_VERSION:
+        return False
+    # don't mix tenants
+    tenant_id = getattr(sdk, "tenant_id", None)
+    if tenant_id and snapshot.get("tenant_id") and snapshot["tenant_id"] != tenant_id:
+        # tables loaded before login came from the same snapshot
+        clear()
+        return False
+
+    with lock:
+        if snapshot.get("sites") is not None:
+            _build_sites(snapshot["sites"])
+            db_time['sites'] = snapshot["db_time"]["sites"]
+        if snapshot.get("elements") is not None:
+            _build_elements(snapshot["elements"])
+            db_time['elements'] = snapshot["db_time"]["elements"]
+        if snapshot.get("zones") is not None:
+            _build_zones(snapshot["zones"])
+            db_time['zones'] = snapshot["db_time"]["zones"]
+    return bool(db_time)
+
+@metrics.timed
+@tracing.traced
+def refresh():
+    """ fetch all tables from the controller and update the snapshot
+    :returns: True if all tables were fetched
+    :rtype: bool
+    """
+    sites = _get_items('sites')
+    elements = _get_items('elements')
+    zones = _get_items('zones')
+    if sites is None or elements is None or zones is None:
+        return False
+    with lock:
+        _build_sites(sites)
+        _build_elements(elements)
+        _build_zones(zones)
+        db_time['sites'] = db_time['elements'] = db_time['zones'] = time.time()
+        save_cache()
+    return True
+
+def refresh_background():
+    """ refresh the tables in a background thread
+    :returns: the refresh thread
+    :rtype: threading.Thread
+    """
+    def worker():
+        try:
+            refresh()
+        except Exception as e:
+            log.warning(f"Background refresh failed: {e}")
+    thread = threading.Thread(target=worker, name="db-refresh", daemon=True)
+    thread.start()
+    return thread
+
+def _query_items(kind, data):
+    """ run a query on a list
+    :returns: objects, None if the request failed or the result was truncated
+    :rtype: list
+    """
+    res = getattr(sdk.post, QUERIES[kind])(dict(data, limit=SYNC_QUERY_LIMIT))
+    if not res:
+        log.error(f"Can't query {kind}: {sdk.pull_content_error(res)}")
+        return None
+    items = res.cgx_content.get('items') or []
+    if len(items) < res.cgx_content.get('total_count', len(items)):
+        log.info(f"--- {kind} query truncated at {len(items)} objects")
+        return None
+    return items
+
+def _sync_kind(kind):
+    """ bring a loaded list up to date
+    :returns: True if the list is current, None if nothing changed, False on failure
+    """
+    # id and _etag of every object, compared with the loaded ones
+    etags = _query_items(kind, {"retrieved_fields": ["id", "_etag"], "retrieved_fields_mask": False})
+    if etags is None or any('_etag' not in item for item in etags):
+        log.info(f"--- Can't list {kind} changes, fetching all {kind}")
+        items = _get_items(kind)
+        if items is None:
+            return False
+        _build(kind, items)
+        return True
+
+    loaded = {item['id']: item for item in _items(kind)}
+    changed_ids = [item['id'] for item in etags if loaded.get(item['id'], {}).get('_etag') != item['_etag']]
+    removed = len(loaded.keys() - {item['id'] for item in etags})
+    if not changed_ids and not removed:
+        return None
+    changed = {}
+    if changed_ids:
+        items = _query_items(kind, {"query_params": {"id": {"in": changed_ids}}})
+        if items is None:
+            return False
+        changed = {item['id']: item for item in items}
+    log.info(f"--- {kind}: {len(changed)} changed, {removed} removed")
+    # keep the controller's order, drop objects removed since the query
+    _build(kind, [changed.get(item['id']) or loaded[item['id']] for item in etags if item['id'] in changed or item['id'] in loaded])
+    return True
+
+@metrics.timed
+@tracing.traced
+def sync(kinds=None):
+    """ update the loaded tables with the objects added or changed on the controller since they were
+    fetched, and drop the removed ones. Costs one id/_etag query per list, plus one query for the
+    changed objects. Lists that were never loaded are left to be fetched on first use
+    :param kinds: lists to sync, sites, elements and zones by default
+    :type kinds: list
+    :returns: True if the loaded tables are current
+    :rtype: bool
+    """
+    success = True
+    updated = False
+    _login()
+    with lock:
+        for kind in kinds or ['sites', 'elements', 'zones']:
+            if kind not in db_time:
+                continue
+            sync_time = time.time()
+            res = _sync_kind(kind)
+            if res is False:
+                success = False
+                continue
+            updated = updated or res
+            db_time[kind] = sync_time
+        if updated:
+            save_cache()
+    return success
+
+def sync_background(interval=None):
+    """ sync the tables in a background thread, once or every interval seconds until stop_sync is
+    called. Starting a timer stops the previous one
+    :param interval: seconds between syncs. None to sync once
+    :type interval: float
+    :returns: the sync thread
+    :rtype: threading.Thread
+    """
+    global sync_stop, sync_thread
+    stop = threading.Event()
+    if interval:
+        stop_sync()
+        sync_stop = stop
+    def worker():
+        while True:
+            try:
+                sync()
+            except Exception as e:
+                log.warning(f"Background sync failed: {e}")
+            if not interval or stop.wait(interval):
+                return
+    thread = threading.Thread(target=worker, name="db-sync", daemon=True)
+    thread.start()
+    if interval:
+        sync_thread = thread
+    return thread
+
+def stop_sync():
+    """ stop the sync_background timer, waiting for a sync in progress to finish
+    """
+    sync_stop.set()
+    if sync_thread and sync_thread is not threading.current_thread():
+        sync_thread.join()
 
 def fetch(db_name, db_key):
     """ extract object by key
@@ -37,24 +497,90 @@ def fetch(db_name, db_key):
     :returns: object
     :rtype: dictionary
     """
-    # if tranlatio db is empty, build it
-    if not db[db_name]:
-        init_db(db_name)
+    # if tranlatio db is empty or expired, build it
+    _ensure(db_name)
     return db[db_name].get(db_key, None)
+
+# db_name -> (table, sorted keys of the table). Rebuilt when the table is replaced
+sorted_keys = {}
+
+@functools.lru_cache(maxsize=256)
+def _compile(db_re):
+    """ compiled regular expression and the literal prefix every match starts with
+    """
+    pattern = re.compile(db_re)
+    prefix = ""
+    m = re.match(r"\^([^.^$*+?{}\[\]\\|()]*)", db_re)
+    if m and "|" not in db_re:
+        prefix = m.group(1)
+        # a quantifier makes the last literal character optional
+        if db_re[m.end():m.end() + 1] in ("*", "?", "{"):
+            prefix = prefix[:-1]
+    return pattern, prefix
+
+@functools.lru_cache(maxsize=256)
+def _compile_glob(pattern):
+    """ compiled glob pattern and its literal prefix
+    """
+    m = re.match(r"[^*?\[]*", pattern)
+    return re.compile(fnmatch.translate(pattern)), m.group(0)
+
+def _keys(db_name, prefix=""):
+    """ keys of a table starting with prefix, from the sorted key index
+    """
+    table = db[db_name]
+    index = sorted_keys.get(db_name)
+    if not index or index[0] is not table:
+        index = (table, sorted(key for key in table if isinstance(key, str)))
+        sorted_keys[db_name] = index
+    keys = index[1]
+    if not prefix:
+        return keys
+    start = bisect.bisect_left(keys, prefix)
+    end = bisect.bisect_left(keys, prefix + "\U0010ffff", start)
+    return keys[start:end]
+
 def get_re(db_name, db_re):
     """ get a list of object by re on the key
     :param db_name: Cloudgenix sites object id
     :type db_name: str
-    :param db_re: regular expression to search
+    :param db_re: regular expression to search. Patterns starting with ^literal only scan the matching keys
     :type db_re: str - re format
     :returns: mathcing objects
     :rtype: list of dictionary
-    """ 
-    if not db[db_name]:
-        init_db(db_name)
+    """
+    _ensure(db_name)
+    pattern, prefix = _compile(db_re)
+    table = db[db_name]
 
     return [
-        value for key, value in db[db_name].items() 
-        if key and re.search(db_re, key)
+        table[key] for key in _keys(db_name, prefix)
+        if key and pattern.search(key)
     ]
-    
\ No newline at end of file
+
+def get_glob(db_name, pattern):
+    """ get a list of object by shell style pattern on the key
+    :param db_name: The database name
+    :type db_name: str
+    :param pattern: pattern, "branch-*" or "ion-??"
+    :type pattern: str
+    :returns: mathcing objects
+    :rtype: list of dictionary
+    """
+    _ensure(db_name)
+    compiled, prefix = _compile_glob(pattern)
+    table = db[db_name]
+    return [table[key] for key in _keys(db_name, prefix) if compiled.match(key)]
+
+def get_prefix(db_name, prefix):
+    """ get a list of object whose key starts with prefix
+    :param db_name: The database name
+    :type db_name: str
+    :param prefix: key prefix
+    :type prefix: str
+    :returns: mathcing objects
+    :rtype: list of dictionary
+    """
+    _ensure(db_name)
+    table = db[db_name]
+    return [table[key] for key in _keys(db_name, prefix)]
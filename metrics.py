@@ -0,0 +1,194 @@
+# API call metrics
+import json
+import time
+import bisect
+import functools
+import threading
+
+# latency histogram bucket upper bounds in seconds
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+lock = threading.Lock()
+# SDK calls per endpoint, "get.interfaces"
+calls = {}
+# cgxEasyAPI and db methods, "set_interface_zone"
+methods = {}
+# name -> function returning the current value
+gauges = {}
+
+def _new_entry():
+    return {
+        "count": 0,
+        "errors": 0,
+        "bytes": 0,
+        "status": {},
+        "latency_sum": 0.0,
+        "latency_buckets": [0] * (len(BUCKETS) + 1),
+    }
+
+def _observe(entry, latency):
+    entry["count"] += 1
+    entry["latency_sum"] += latency
+    entry["latency_buckets"][bisect.bisect_left(BUCKETS, latency)] += 1
+
+def record_call(endpoint, latency, status_code, nbytes):
+    """ record an SDK call
+    :param endpoint: SDK namespace and function, "get.interfaces"
+    :type endpoint: str
+    :param latency: call duration in seconds
+    :type latency: float
+    :param status_code: HTTP status code
+    :type status_code: int
+    :param nbytes: response body size
+    :type nbytes: int
+    """
+    with lock:
+        entry = calls.setdefault(endpoint, _new_entry())
+        _observe(entry, latency)
+        entry["bytes"] += nbytes
+        entry["status"][status_code] = entry["status"].get(status_code, 0) + 1
+        if status_code >= 400:
+            entry["errors"] += 1
+
+def record_method(name, latency, ok):
+    """ record a high level method call
+    :param name: method name
+    :type name: str
+    :param latency: call duration in seconds
+    :type latency: float
+    :param ok: True if the method succeeded
+    :type ok: bool
+    """
+    with lock:
+        entry = methods.setdefault(name, _new_entry())
+        _observe(entry, latency)
+        if not ok:
+            entry["errors"] += 1
+
+def timed(func):
+    """ decorator recording calls of a method returning (Success, ErrMSG).
+    Methods are recorded by name, module functions as module.name
+    """
+    name = func.__name__ if "." in func.__qualname__ else f"{func.__module__}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        ok = False
+        try:
+            result = func(*args, **kwargs)
+            ok = not isinstance(result, tuple) or bool(result[0])
+            return result
+        finally:
+            record_method(name, time.monotonic() - start, ok)
+    return wrapper
+
+def register_gauge(name, func):
+    """ add a value read at export time
+    :param name: metric name
+    :type name: str
+    :param func: function returning a number
+    :type func: function
+    """
+    gauges[name] = func
+
+def reset():
+    """ clear all counters
+    """
+    with lock:
+        calls.clear()
+        methods.clear()
+
+def snapshot():
+    """ copy of all metrics
+    :returns: calls, methods and gauges
+    :rtype: dict
+    """
+    with lock:
+        data = json.loads(json.dumps({"calls": calls, "methods": methods}))
+    data["buckets"] = BUCKETS
+    data["gauges"] = {name: func() for name, func in gauges.items()}
+    return data
+
+def to_json():
+    """ metrics as JSON text
+    :rtype: str
+    """
+    return json.dumps(snapshot(), indent=2)
+
+def percentile(entry, fraction):
+    """ estimate a latency percentile from the histogram
+    :param entry: call or method metrics
+    :type entry: dict
+    :param fraction: 0.95 for p95
+    :type fraction: float
+    :returns: bucket upper bound in seconds, None if there are no calls
+    :rtype: float
+    """
+    if not entry["count"]:
+        return None
+    target = entry["count"] * fraction
+    seen = 0
+    for bound, count in zip(BUCKETS + [float("inf")], entry["latency_buckets"]):
+        seen += count
+        if seen >= target:
+            return bound
+    return float("inf")
+
+def _prometheus_histogram(lines, name, labels, entry):
+    cumulative = 0
+    for bound, count in zip(BUCKETS + ["+Inf"], entry["latency_buckets"]):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {entry["latency_sum"]}')
+    lines.append(f'{name}_count{{{labels}}} {entry["count"]}')
+
+def to_prometheus():
+    """ metrics in the Prometheus text exposition format
+    :rtype: str
+    """
+    data = snapshot()
+    lines = [
+        "# TYPE cgx_api_call_seconds histogram",
+    ]
+    for endpoint, entry in sorted(data["calls"].items()):
+        _prometheus_histogram(lines, "cgx_api_call_seconds", f'endpoint="{endpoint}"', entry)
+    lines.append("# TYPE cgx_api_call_bytes_total counter")
+    for endpoint, entry in sorted(data["calls"].items()):
+        lines.append(f'cgx_api_call_bytes_total{{endpoint="{endpoint}"}} {entry["bytes"]}')
+    lines.append("# TYPE cgx_api_call_status_total counter")
+    for endpoint, entry in sorted(data["calls"].items()):
+        for status_code, count in sorted(entry["status"].items()):
+            lines.append(f'cgx_api_call_status_total{{endpoint="{endpoint}",code="{status_code}"}} {count}')
+    lines.append("# TYPE cgx_method_seconds histogram")
+    for name, entry in sorted(data["methods"].items()):
+        _prometheus_histogram(lines, "cgx_method_seconds", f'method="{name}"', entry)
+    lines.append("# TYPE cgx_method_errors_total counter")
+    for name, entry in sorted(data["methods"].items()):
+        lines.append(f'cgx_method_errors_total{{method="{name}"}} {entry["errors"]}')
+    for name, value in sorted(data["gauges"].items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def to_table():
+    """ metrics as a text table, slowest total time first
+    :rtype: str
+    """
+    data = snapshot()
+    rows = []
+    for kind in ("methods", "calls"):
+        for name, entry in data[kind].items():
+            rows.append((name, entry["count"], entry["errors"], entry["latency_sum"],
+                         entry["latency_sum"] / entry["count"] if entry["count"] else 0,
+                         percentile(entry, 0.95), entry.get("bytes", 0)))
+    if not rows:
+        return "No API calls recorded"
+    rows.sort(key=lambda row: row[3], reverse=True)
+    width = max(len("Name"), *(len(row[0]) for row in rows))
+    lines = [f"{'Name':<{width}}  {'Calls':>7}  {'Errors':>6}  {'Total s':>8}  {'Avg s':>7}  {'p95 <=':>6}  {'Bytes':>10}"]
+    for name, count, errors, total, avg, p95, nbytes in rows:
+        lines.append(f"{name:<{width}}  {count:>7}  {errors:>6}  {total:>8.2f}  {avg:>7.3f}  {p95:>6}  {nbytes:>10}")
+    for name, value in sorted(data["gauges"].items()):
+        lines.append(f"{name}: {value}")
+    return "\n".join(lines)
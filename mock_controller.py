@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# local stand-in for the CloudGenix controller API, for benchmarks and offline runs
+import re
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TENANT_ID = "1000"
+# token accepted by the mock controller
+AUTH_TOKEN = "mock-token"
+
+# /v2.1/api/<path>
+API_PATH = re.compile(r"^/v[0-9.]+/api/(.*?)/?(\?.*)?$")
+
+class MockController:
+    """ in memory controller. Every /tenants/<id>/... path is a collection of objects
+    (sites, sites/<id>/elements/<id>/interfaces, ...) supporting GET, POST, PUT, DELETE and
+    POST <collection>/query. A query on a tenant level collection (interfaces/query) searches
+    the nested collections with the same name.
+    """
+    def __init__(self, latency=0, jitter=0, error_rate=0, error_status=503, seed=None):
+        """
+        :param latency: seconds added to every call
+        :type latency: float
+        :param jitter: random extra latency, as a fraction of latency
+        :type jitter: float
+        :param error_rate: fraction of calls failing with error_status
+        :type error_rate: float
+        :param error_status: HTTP status code of injected errors
+        :type error_status: int
+        :param seed: random seed for the latency jitter and the injected errors
+        :type seed: int
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        # collection path -> object id -> object
+        self.store = {}
+        # "METHOD path" with ids replaced by {id} -> number of calls
+        self.calls = Counter()
+        self.ids = itertools.count(100000)
+        self.lock = threading.Lock()
+        self.server = None
+
+    def new_id(self):
+        return str(next(self.ids))
+
+    def add(self, collection, item):
+        """ add an object to a collection
+        :param collection: collection path, "sites" or "sites/<id>/waninterfaces"
+        :type collection: str
+        :param item: object. An id and _etag are added if missing
+        :type item: dict
+        :return: the object
+        :rtype: dict
+        """
+        item.setdefault("id", self.new_id())
+        item.setdefault("_etag", 1)
+        # parent ids, sites/1/elements/2/interfaces -> site_id 1, element_id 2
+        parts = collection.split("/")
+        for name, parent_id in zip(parts[:-1:2], parts[1::2]):
+            item.setdefault(f"{name[:-1]}_id", parent_id)
+        self.store.setdefault(collection, {})[item["id"]] = item
+        return item
+
+    def populate(self, elements, elements_per_site=2, interfaces_per_element=8, hubs=2):
+        """ create sites, elements with interfaces, WAN interfaces, DHCP servers and security zones
+        :param elements: number of elements
+        :type elements: int
+        :param elements_per_site: elements per site
+        :type elements_per_site: int
+        :param interfaces_per_element: ports per element, named "1", "2", ...
+        :type interfaces_per_element: int
+        :param hubs: number of data center sites
+        :type hubs: int
+        """
+        for name in ["LAN", "GUEST", "WAN"]:
+            self.add("securityzones", {"name": name})
+        site_count = max(1, -(-elements // elements_per_site))
+        for site_no in range(site_count):
+            site = self.add("sites", {
+                "name": f"site-{site_no}",
+                "element_cluster_role": "HUB" if site_no < hubs else "SPOKE",
+            })
+            for wan_no, wan_type in enumerate(["publicwan", "privatewan"]):
+                self.add(f"sites/{site['id']}/waninterfaces", {"name": f"wan-{wan_no}", "type": wan_type})
+            self.add(f"sites/{site['id']}/dhcpservers", {
+                "subnet": f"10.{site_no // 256 % 256}.{site_no % 256}.0/24",
+                "custom_options": [],
+            })
+        sites = list(self.store["sites"].values())
+        for element_no in range(elements):
+            site = sites[element_no // elements_per_site]
+            element = self.add("elements", {
+                "name": f"element-{element_no}",
+                "site_id": site["id"],
+                "serial_number": f"SN{element_no:08d}",
+            })
+            for port in range(1, interfaces_per_element + 1):
+                self.add(f"sites/{site['id']}/elements/{element['id']}/interfaces", {
+                    "name": str(port),
+                    "type": "port",
+                    "description": "",
+                    "admin_up": True,
+                    "used_for": "lan",
+                    "tags": None,
+                    "dhcp_relay": None,
+                    "parent": None,
+                    "sub_interface": None,
+                    "ipv4_config": {"type": "static", "static_config": {"address": f"192.168.{port}.1/24"}},
+                })
+
+    def error(self, status, code, message):
+        return status, {"_error": [{"code": code, "message": message}]}
+
+    def query(self, collection, data):
+        """ run a query on a collection and its nested collections of the same name
+        """
+        name = collection.split("/")[-1]
+        items = []
+        for path, objects in self.store.items():
+            if path == collection or (path.endswith(f"/{name}") and path.startswith(collection.rsplit(name, 1)[0])):
+                items.extend(objects.values())
+        for field, condition in (data.get("query_params") or {}).items():
+            if isinstance(condition, dict) and "in" in condition:
+                values = set(condition["in"])
+                items = [item for item in items if item.get(field) in values]
+            else:
+                items = [item for item in items if item.get(field) == condition]
+        total_count = len(items)
+        items = items[:data.get("limit") or total_count]
+        if data.get("retrieved_fields") and not data.get("retrieved_fields_mask"):
+            items = [{field: item[field] for field in data["retrieved_fields"] if field in item} for item in items]
+        return 200, {"count": len(items), "total_count": total_count, "items": items}
+
+    def request(self, method, path, data=None):
+        """ serve an API call
+        :param method: GET, POST, PUT or DELETE
+        :type method: str
+        :param path: URL path after /<version>/api/
+        :type path: str
+        :param data: request body
+        :type data: dict
+        :return: status code, response body
+        :rtype: tuple
+        """
+        parts = path.split("/")
+        with self.lock:
+            self.calls[f"{method} {re.sub(r'^tenants/[^/]+/?', '', re.sub(r'/[0-9]+(?=/|$)', '/{id}', path))}"] += 1
+            fail = self.error_rate and self.random.random() < self.error_rate
+            delay = self.latency * (1 + self.jitter * self.random.random())
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return self.error(self.error_status, "MOCK_ERROR", "Injected error")
+
+        if path == "profile":
+            return 200, {"id": "1", "tenant_id": TENANT_ID, "email": "mock@example.com", "roles": [], "token_session": False}
+        if parts[0] != "tenants" or len(parts) < 2 or parts[1] != TENANT_ID:
+            return self.error(404, "NOT_FOUND", f"Unknown path {path}")
+        if len(parts) == 2:
+            return 200, {"id": TENANT_ID, "name": "Mock tenant", "is_esp": False}
+
+        rest = parts[2:]
+        with self.lock:
+            if len(rest) % 2:
+                # collection
+                collection = "/".join(rest)
+                if method == "GET":
+                    items = list(self.store.get(collection, {}).values())
+                    return 200, {"count": len(items), "items": items}
+                if method == "POST":
+                    item = dict(data or {}, id=self.new_id())
+                    # the controller names sub interfaces <parent name>.<vlan>
+                    if item.get("type") == "subinterface" and not item.get("name"):
+                        parent = self.store.get(collection, {}).get(item.get("parent"), {})
+                        item["name"] = f"{parent.get('name')}.{(item.get('sub_interface') or {}).get('vlan_id')}"
+                    return 200, self.add(collection, item)
+                return self.error(405, "METHOD_NOT_ALLOWED", f"{method} {path}")
+
+            collection, item_id = "/".join(rest[:-1]), rest[-1]
+            if method == "POST" and item_id == "query":
+                return self.query(collection, data or {})
+            objects = self.store.get(collection, {})
+            if item_id not in objects:
+                return self.error(404, "NOT_FOUND", f"{collection} {item_id} not found")
+            if method == "GET":
+                return 200, objects[item_id]
+            if method == "PUT":
+                item = dict(data or {}, id=item_id, _etag=objects[item_id]["_etag"] + 1)
+                objects[item_id] = item
+                return 200, item
+            if method == "DELETE":
+                return 200, objects.pop(item_id)
+            return self.error(405, "METHOD_NOT_ALLOWED", f"{method} {path}")
+
+    def start(self, host="127.0.0.1", port=0):
+        """ serve the API over HTTP in a background thread
+        :param port: TCP port, 0 for any free port
+        :type port: int
+        :return: controller URL
+        :rtype: str
+        """
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.server.controller = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+class Handler(BaseHTTPRequestHandler):
+    # keep-alive, like the real controller
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, don't wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def handle_method(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        m = API_PATH.match(self.path)
+        if not m:
+            status, content = 404, {"_error": [{"code": "NOT_FOUND", "message": self.path}]}
+        else:
+            try:
+                data = json.loads(body) if body else None
+            except ValueError:
+                data = None
+            status, content = self.server.controller.request(self.command, m.group(1), data)
+        payload = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = handle_method
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock CloudGenix controller")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--elements", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0, help="random extra latency as a fraction of --latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of calls failing")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    controller = MockController(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status)
+    controller.populate(args.elements)
+    url = controller.start(port=args.port)
+    print(f"Mock controller on {url}, auth token {AUTH_TOKEN}. Ctrl-C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        controller.stop()
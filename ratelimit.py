@@ -0,0 +1,127 @@
+# token bucket rate limiting of controller API calls
+import os
+import time
+import threading
+try:
+    import fcntl
+except ImportError:
+    # no file locking, buckets can't be shared between processes
+    fcntl = None
+
+class TokenBucket:
+    """ token bucket shared by the threads of a process
+    """
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: tokens added per second
+        :type rate: float
+        :param burst: maximum number of tokens. Default one second worth of tokens
+        :type burst: float
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst else max(1.0, rate))
+        self.tokens = self.burst
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self, tokens, now):
+        """ refill the bucket and take tokens
+        :returns: seconds to wait before the tokens are available, 0 if taken
+        :rtype: float
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """ block until tokens are available
+        :param tokens: number of tokens to take
+        :type tokens: float
+        :returns: seconds waited
+        :rtype: float
+        """
+        waited = 0
+        while True:
+            with self.lock:
+                wait = self._take(tokens, time.monotonic())
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+class FileTokenBucket(TokenBucket):
+    """ token bucket shared by all processes using the same state file.
+    The bucket state is kept in the file and updated under an exclusive lock
+    """
+    def __init__(self, rate, file_name, burst=None):
+        """
+        :param rate: tokens added per second
+        :type rate: float
+        :param file_name: bucket state file
+        :type file_name: str
+        :param burst: maximum number of tokens. Default one second worth of tokens
+        :type burst: float
+        """
+        super().__init__(rate, burst)
+        self.file_name = file_name
+
+    def acquire(self, tokens=1):
+        waited = 0
+        while True:
+            with self.lock, open(self.file_name, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    self.tokens, self.timestamp = (float(value) for value in f.read().split())
+                except ValueError:
+                    # new or corrupt state file, start with a full bucket
+                    self.tokens, self.timestamp = self.burst, time.time()
+                # wall clock, monotonic clocks aren't shared between processes
+                wait = self._take(tokens, max(time.time(), self.timestamp))
+                f.seek(0)
+                f.truncate()
+                f.write(f"{self.tokens} {self.timestamp}")
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+class RateLimiter:
+    """ separate read and write token buckets for controller API calls
+    """
+    def __init__(self, read_rate=None, write_rate=None, read_burst=None, write_burst=None, shared_file=None):
+        """
+        :param read_rate: GET and query calls per second. None for no limit
+        :type read_rate: float
+        :param write_rate: PUT/POST/DELETE/PATCH calls per second. None for no limit
+        :type write_rate: float
+        :param read_burst: maximum read calls sent at once
+        :type read_burst: float
+        :param write_burst: maximum write calls sent at once
+        :type write_burst: float
+        :param shared_file: share the buckets with other processes using <shared_file>.read and <shared_file>.write
+        :type shared_file: str
+        """
+        if shared_file and not fcntl:
+            raise ValueError("Sharing rate limits between processes needs fcntl")
+        self.buckets = {}
+        for kind, rate, burst in (("read", read_rate, read_burst), ("write", write_rate, write_burst)):
+            if not rate:
+                continue
+            if shared_file:
+                self.buckets[kind] = FileTokenBucket(rate, f"{os.path.expanduser(shared_file)}.{kind}", burst)
+            else:
+                self.buckets[kind] = TokenBucket(rate, burst)
+
+    def acquire(self, kind):
+        """ block until a call of kind can be sent
+        :param kind: read or write
+        :type kind: str
+        :returns: seconds waited
+        :rtype: float
+        """
+        bucket = self.buckets.get(kind)
+        return bucket.acquire() if bucket else 0
@@ -0,0 +1,140 @@
+# nested trace spans written in the Chrome trace event format.
+# Open the trace file with chrome://tracing or https://ui.perfetto.dev
+import os
+import time
+import json
+import inspect
+import itertools
+import functools
+import threading
+import contextlib
+import contextvars
+
+# False until start() is called, spans cost nothing while tracing is off
+enabled = False
+trace_file = None
+
+lock = threading.Lock()
+events = []
+threads = {}
+origin = time.perf_counter()
+span_ids = itertools.count(1)
+# id of the span the running code is in
+current = contextvars.ContextVar("cgxEasyAPI_span", default=None)
+
+# arguments that are not recorded in spans
+SECRET_ARGS = ["phrase", "password", "secret", "token"]
+
+def start(file_name):
+    """ start recording spans
+    :param file_name: trace file written by stop()
+    :type file_name: str
+    """
+    global enabled, trace_file
+    with lock:
+        events.clear()
+        threads.clear()
+        trace_file = os.path.expanduser(file_name)
+        enabled = True
+
+def stop():
+    """ stop recording spans and write the trace file
+    :return: Success, ErrMSG
+    :rtype Success: Boolean
+    :rtype ErrMSG: String
+    """
+    global enabled
+    with lock:
+        if not enabled:
+            return False, "Tracing is not started"
+        enabled = False
+        trace = list(events)
+        trace.extend(
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+            for tid, name in threads.items()
+        )
+        events.clear()
+    try:
+        with open(trace_file, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f, default=str)
+    except OSError as e:
+        return False, f"Can't write trace file {trace_file}: {e}"
+    return True, f"{len(trace) - len(threads)} spans written to {trace_file}"
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """ record the enclosed code as a span, nested in the current span
+    :param name: span name
+    :type name: str
+    :param attributes: recorded with the span. The yielded dictionary can be updated inside the span
+    """
+    if not enabled:
+        yield attributes
+        return
+    parent_id = current.get()
+    span_id = next(span_ids)
+    token = current.set(span_id)
+    begin = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        end = time.perf_counter()
+        current.reset(token)
+        attributes["span_id"] = span_id
+        attributes["parent_id"] = parent_id
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (begin - origin) * 1e6,
+            "dur": (end - begin) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": attributes,
+        }
+        with lock:
+            if enabled:
+                events.append(event)
+                threads.setdefault(event["tid"], threading.current_thread().name)
+
+def traced(func):
+    """ decorator recording calls of a method returning (Success, ErrMSG) as spans.
+    Methods are named by name, module functions as module.name. Arguments are recorded except secrets
+    """
+    name = func.__name__ if "." in func.__qualname__ else f"{func.__module__}.{func.__name__}"
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        bound = signature.bind_partial(*args, **kwargs)
+        attributes = {
+            arg: str(value)[:200]
+            for arg, value in bound.arguments.items()
+            if arg != "self" and not any(secret in arg for secret in SECRET_ARGS)
+        }
+        with span(name, **attributes) as attributes:
+            result = func(*args, **kwargs)
+            if isinstance(result, tuple) and len(result) == 2:
+                attributes["success"] = bool(result[0])
+                attributes["message"] = str(result[1])[:200]
+            return result
+    return wrapper
+
+def bind(func):
+    """ run func in the current span when it is called from another thread,
+    e.g. by a ThreadPoolExecutor
+    :param func: function
+    :type func: function
+    :return: function
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        # a context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+    return run
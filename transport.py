@@ -0,0 +1,217 @@
+# transport layer between cgxEasyAPI and the cloudgenix SDK
+import time
+import random
+import logging
+import email.utils
+import requests
+import cloudgenix
+import metrics
+import tracing
+
+log = logging.getLogger("cgxEasyAPI.transport")
+
+# SDK namespaces that are wrapped
+NAMESPACES = ["get", "put", "post", "delete", "patch"]
+
+# number of keep-alive connections to the controller
+POOL_SIZE = 32
+
+# retry policy per SDK namespace. A "<namespace>.<endpoint>" entry overrides the namespace policy,
+# "query" applies to the read only post.*_query endpoints
+RETRY = {
+    "default": {
+        "retries": 0,               # number of retries after the first attempt
+        "backoff": 0.5,             # first retry delay in seconds, doubled on every retry
+        "max_backoff": 30,          # maximum delay between retries
+        "status": [429, 500, 502, 503, 504, 599],  # status codes to retry on. 599 is a connection error
+    },
+    "get": {"retries": 5},
+    "put": {"retries": 5},
+    "delete": {"retries": 5},
+    "query": {"retries": 5},
+}
+
+# status code used for requests that didn't get a response
+CONNECTION_ERROR = 599
+
+def is_query(namespace, endpoint):
+    """ check if an SDK call is one of the read only post.*_query calls
+    :rtype: bool
+    """
+    return namespace == "post" and endpoint.endswith("_query")
+
+def retry_after(res):
+    """ delay requested by the controller in the Retry-After header
+    :param res: response
+    :type res: requests.Response
+    :returns: seconds or None
+    :rtype: float
+    """
+    value = res.headers.get("Retry-After") if res.headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def connection_error_response(res):
+    """ the SDK returns the requests.Response class itself when the request didn't get a response,
+    which is truthy. Turn it into a failed response instance
+    :param res: the SDK response class
+    :returns: failed response with status_code CONNECTION_ERROR
+    :rtype: requests.Response
+    """
+    response = requests.Response()
+    response.status_code = CONNECTION_ERROR
+    response.reason = "Connection Error"
+    response._content = b""
+    response.cgx_status = False
+    # pull_content_error only reports errors that have a code
+    response.cgx_content = {
+        '_error': [
+            dict(error, code=error.get('code') or "CONNECTION_ERROR")
+            for error in res.cgx_content.get('_error', [])
+        ]
+    }
+    response.cgx_errors = getattr(res, "cgx_errors", None)
+    response.cgx_warnings = getattr(res, "cgx_warnings", None)
+    return response
+
+class Namespace:
+    """ stands in for sdk.get, sdk.put, ... and sends every call through the transport
+    """
+    def __init__(self, transport, name, namespace):
+        self._transport = transport
+        self._name = name
+        self._namespace = namespace
+
+    def __getattr__(self, endpoint):
+        func = getattr(self._namespace, endpoint)
+        if not callable(func):
+            return func
+
+        def call(*args, **kwargs):
+            return self._transport.call(self._name, endpoint, func, *args, **kwargs)
+        call.__name__ = endpoint
+        call.__doc__ = func.__doc__
+        return call
+
+class Transport:
+    """ wraps an authenticated cloudgenix.API object. sdk.get/put/post/delete/patch calls are retried
+    with jittered exponential backoff, everything else is passed to the SDK object
+    """
+    def __init__(self, sdk, pool_size=POOL_SIZE, retry=None, rate_limiter=None, concurrency=None, cassette=None):
+        """
+        :param sdk: authenticated cloudgenix API object
+        :type sdk: cloudgenix.API()
+        :param pool_size: number of keep-alive connections to the controller
+        :type pool_size: int
+        :param retry: retry policy overrides, same format as RETRY
+        :type retry: dict
+        :param rate_limiter: read/write request budget. None for no limit
+        :type rate_limiter: ratelimit.RateLimiter
+        :param concurrency: adaptive limit of calls in flight. None for no limit
+        :type concurrency: concurrency.AIMDLimiter
+        :param cassette: record the calls, or replay them without the network. None for neither
+        :type cassette: cassette.Cassette
+        """
+        self.sdk = sdk
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.cassette = cassette
+        self.retry = {key: dict(value) for key, value in RETRY.items()}
+        for key, value in (retry or {}).items():
+            self.retry.setdefault(key, {}).update(value)
+        for name in NAMESPACES:
+            setattr(self, name, Namespace(self, name, getattr(sdk, name)))
+
+        # retries are done here, don't let urllib3 retry as well. Error statuses must come back
+        # as responses, urllib3 raises RetryError for statuses in its status_forcelist
+        sdk.modify_rest_retry(total=0, status_forcelist=(), raise_on_status=False, update_adapter=False)
+        self.set_pool_size(pool_size)
+
+        if concurrency:
+            metrics.register_gauge("cgx_concurrency_limit", lambda: concurrency.limit)
+            metrics.register_gauge("cgx_concurrency_in_flight", lambda: concurrency.in_flight)
+
+    def __getattr__(self, name):
+        return getattr(self.sdk, name)
+
+    def set_pool_size(self, pool_size):
+        """Resize the HTTP connection pool so pool_size requests can be in flight without
+        opening and closing connections
+        :param pool_size: number of keep-alive connections to the controller
+        :type pool_size: int
+        """
+        sdk = self.sdk
+        adapter = cloudgenix.TlsHttpAdapter(
+            ssl_context=sdk._ca_ssl_context,
+            max_retries=sdk._rest_call_retry_object,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+        # http:// too, so mock controller runs use the same adapter as the real controller
+        for adapter_url in ("https://", "http://"):
+            sdk.update_session_adapter(adapter=adapter, adapter_url=adapter_url)
+
+    def policy(self, namespace, endpoint):
+        """ retry policy of an endpoint
+        :returns: policy dictionary
+        :rtype: dict
+        """
+        policy = dict(self.retry["default"])
+        if is_query(namespace, endpoint):
+            policy.update(self.retry.get("query", {}))
+        else:
+            policy.update(self.retry.get(namespace, {}))
+        policy.update(self.retry.get(f"{namespace}.{endpoint}", {}))
+        return policy
+
+    def call(self, namespace, endpoint, func, *args, **kwargs):
+        """ call an SDK function, retrying on the policy status codes
+        :returns: the SDK response
+        :rtype: requests.Response
+        """
+        policy = self.policy(namespace, endpoint)
+        kind = "read" if namespace == "get" or is_query(namespace, endpoint) else "write"
+        attempt = 0
+        while True:
+            with tracing.span(f"{namespace}.{endpoint}", attempt=attempt) as attributes:
+                if self.rate_limiter:
+                    attributes["rate_limit_wait"] = self.rate_limiter.acquire(kind)
+                if self.concurrency:
+                    attributes["concurrency_wait"] = self.concurrency.acquire()
+                start = time.monotonic()
+                status_code = CONNECTION_ERROR
+                try:
+                    if self.cassette and self.cassette.replaying:
+                        res = self.cassette.replay(namespace, endpoint, args, kwargs)
+                    else:
+                        res = func(*args, **kwargs)
+                        if isinstance(res, type):
+                            res = connection_error_response(res)
+                        if self.cassette:
+                            self.cassette.record(namespace, endpoint, args, kwargs, res, time.monotonic() - start)
+                    status_code = res.status_code
+                finally:
+                    latency = time.monotonic() - start
+                    attributes["status"] = status_code
+                    if self.concurrency:
+                        self.concurrency.release(latency, status_code)
+            metrics.record_call(f"{namespace}.{endpoint}", latency, status_code, len(res.content or b""))
+            if res or res.status_code not in policy["status"] or attempt >= policy["retries"]:
+                return res
+
+            delay = retry_after(res)
+            if delay is None:
+                delay = min(policy["max_backoff"], policy["backoff"] * 2 ** attempt) * random.uniform(0.5, 1.5)
+            if self.cassette and self.cassette.replaying:
+                delay *= self.cassette.speed
+            attempt += 1
+            log.info(f"{namespace}.{endpoint} returned {res.status_code}, retry {attempt}/{policy['retries']} in {delay:.1f}s")
+            time.sleep(delay)